@@ -0,0 +1,30 @@
+"""Add email MFA code lookup index
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Index unused codes by user and hash so verification is a single probe
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_email_mfa_codes_user_code_hash
+        ON email_mfa_codes (user_id, code_hash)
+        WHERE used = FALSE
+    """)
+
+
+def downgrade() -> None:
+    # Drop index
+    op.execute("DROP INDEX IF EXISTS idx_email_mfa_codes_user_code_hash")
@@ -0,0 +1,46 @@
+"""Add backup codes remaining count
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Add backup_codes_remaining column to users table
+    # NULL means not yet counted; it is filled in the next time the codes are decrypted
+    op.execute("""
+        ALTER TABLE users 
+        ADD COLUMN backup_codes_remaining INTEGER
+    """)
+    
+    # Users without backup codes have none remaining
+    op.execute("""
+        UPDATE users 
+        SET backup_codes_remaining = 0
+        WHERE backup_codes_encrypted IS NULL
+    """)
+    
+    # New rows start with no codes, matching the column definition in sql/init
+    op.execute("""
+        ALTER TABLE users 
+        ALTER COLUMN backup_codes_remaining SET DEFAULT 0
+    """)
+
+
+def downgrade() -> None:
+    # Drop backup_codes_remaining column
+    op.execute("""
+        ALTER TABLE users 
+        DROP COLUMN IF EXISTS backup_codes_remaining
+    """)
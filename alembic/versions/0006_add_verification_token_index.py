@@ -0,0 +1,30 @@
+"""Add email verification token index
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-01-01 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Index outstanding verification tokens so verify-email is a single probe
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_email_verification_token
+        ON users (email_verification_token)
+        WHERE email_verification_token IS NOT NULL
+    """)
+
+
+def downgrade() -> None:
+    # Drop index
+    op.execute("DROP INDEX IF EXISTS idx_users_email_verification_token")
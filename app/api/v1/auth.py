@@ -1,6 +1,7 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+import asyncio
+from fastapi import APIRouter, BackgroundTasks, HTTPException, status, Depends
 from app.core.database import Database
-from app.services.user_service import UserService
+from app.services.user_service import UserService, hash_refresh_token
 from app.services.mfa_service import MFAService
 from app.services.firebase_service import FirebaseService
 from app.schemas.user import UserCreate, UserLogin, UserResponse, TokenResponse, RefreshTokenRequest, FirebaseLoginRequest, OAuthLoginResponse, ResendVerificationRequest, ResendVerificationResponse, EmailVerificationRequest, EmailVerificationResponse
@@ -8,7 +9,6 @@ from app.schemas.mfa import LoginResponse, MFALoginVerifyRequest
 from app.api.deps import get_database, get_current_user
 from app.utils.jwt import JWTManager
 from uuid import UUID
-from datetime import datetime
 
 router = APIRouter()
 
@@ -16,12 +16,13 @@ router = APIRouter()
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(
     user: UserCreate,
+    background_tasks: BackgroundTasks,
     db: Database = Depends(get_database)
 ):
     """Register a new user with email verification"""
     try:
         user_service = UserService(db)
-        new_user = await user_service.create_user(user)
+        new_user = await user_service.create_user(user, background_tasks)
         
         # Return user data but inform about email verification requirement
         return {
@@ -60,10 +61,6 @@ async def login(
                 detail="Invalid email or password"
             )
         
-        print(f"DEBUG: About to update last login for user id: {user['id']}")
-        # Update last login
-        await user_service.update_last_login(user["id"])
-        
         # Check if user provided an MFA session token
         if user_credentials.mfa_session_token:
             try:
@@ -76,8 +73,11 @@ async def login(
                     # Valid MFA session token, skip MFA and return full tokens
                     tokens = JWTManager.create_user_tokens(user["id"], user["email"])
                     
-                    # Store refresh token in database
-                    await user_service.store_refresh_token(user["id"], tokens["refresh_token"])
+                    # Update last login and store refresh token concurrently
+                    await asyncio.gather(
+                        user_service.update_last_login(user["id"]),
+                        user_service.store_refresh_token(user["id"], tokens["refresh_token"])
+                    )
                     
                     return LoginResponse(
                         requires_mfa=False,
@@ -90,9 +90,12 @@ async def login(
                 pass
         
         # Check MFA status
-        mfa_status = await mfa_service.get_mfa_status(user["id"])
+        mfa_status = await mfa_service.get_mfa_status(user["id"], user=user)
         
         if mfa_status["mfa_required"]:
+            # Update last login
+            await user_service.update_last_login(user["id"])
+            
             # User has MFA enabled, return temporary token
             mfa_type = "totp" if mfa_status["totp_enabled"] else "email"
             temp_token = JWTManager.create_temp_token(user["id"], user["email"], mfa_type)
@@ -123,8 +126,11 @@ async def login(
             # No MFA required, return full tokens
             tokens = JWTManager.create_user_tokens(user["id"], user["email"])
             
-            # Store refresh token in database
-            await user_service.store_refresh_token(user["id"], tokens["refresh_token"])
+            # Update last login and store refresh token concurrently
+            await asyncio.gather(
+                user_service.update_last_login(user["id"]),
+                user_service.store_refresh_token(user["id"], tokens["refresh_token"])
+            )
             
             return LoginResponse(
                 requires_mfa=False,
@@ -276,14 +282,13 @@ async def refresh_token(
         # Check if refresh token exists in database
         query = """
         SELECT * FROM user_sessions 
-        WHERE user_id = $1 AND refresh_token_hash = $2 AND is_active = TRUE AND expires_at > $3
+        WHERE user_id = $1 AND refresh_token_hash = $2 AND is_active = TRUE AND expires_at > CURRENT_TIMESTAMP
         """
         
         # Hash the refresh token for comparison
-        import hashlib
-        token_hash = hashlib.sha256(refresh_request.refresh_token.encode()).hexdigest()
+        token_hash = hash_refresh_token(refresh_request.refresh_token)
         
-        session = await db.fetchrow(query, user_id, token_hash, datetime.utcnow())
+        session = await db.fetchrow(query, user_id, token_hash)
         
         if not session:
             raise HTTPException(
@@ -358,12 +363,13 @@ async def verify_email(
 @router.post("/resend-verification", response_model=ResendVerificationResponse)
 async def resend_verification_email(
     request: ResendVerificationRequest,
+    background_tasks: BackgroundTasks,
     db: Database = Depends(get_database)
 ):
     """Resend verification email"""
     try:
         user_service = UserService(db)
-        success = await user_service.resend_verification_email(request.email)
+        success = await user_service.resend_verification_email(request.email, background_tasks)
         
         if success:
             return ResendVerificationResponse(
@@ -428,16 +434,15 @@ async def logout(
             )
         
         # Hash the refresh token
-        import hashlib
-        token_hash = hashlib.sha256(refresh_request.refresh_token.encode()).hexdigest()
+        token_hash = hash_refresh_token(refresh_request.refresh_token)
         
         # Mark session as inactive and check if any rows were affected
         query = """
         UPDATE user_sessions 
-        SET is_active = FALSE, last_used_at = $1
-        WHERE refresh_token_hash = $2 AND is_active = TRUE
+        SET is_active = FALSE, last_used_at = CURRENT_TIMESTAMP
+        WHERE refresh_token_hash = $1 AND is_active = TRUE
         """
-        result = await db.execute(query, datetime.utcnow(), token_hash)
+        result = await db.execute(query, token_hash)
         
         # Check if the token was actually found and revoked
         if result.rowcount == 0:
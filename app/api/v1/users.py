@@ -30,7 +30,7 @@ async def update_profile(
     """Update current user profile"""
     try:
         user_service = UserService(db)
-        updated_user = await user_service.update_user_profile(current_user["id"], profile)
+        updated_user = await user_service.update_user_profile(current_user["id"], profile, current_user)
         
         if not updated_user:
             raise HTTPException(
@@ -21,9 +21,11 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 7
+    BCRYPT_ROUNDS: int = 12
     
     # Encryption
     FERNET_KEY: Optional[str] = None
+    MFA_HMAC_KEY: Optional[str] = None
     
     # OAuth
     GOOGLE_CLIENT_ID: Optional[str] = None
@@ -55,6 +57,9 @@ class Settings(BaseSettings):
         # Generate Fernet key if not provided
         if not self.FERNET_KEY:
             self.FERNET_KEY = Fernet.generate_key().decode()
+        # Key email MFA code hashes with the app secret if no dedicated key is set
+        if not self.MFA_HMAC_KEY:
+            self.MFA_HMAC_KEY = self.SECRET_KEY
 
 
 # Create settings instance
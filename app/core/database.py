@@ -6,17 +6,26 @@ from app.core.config import settings
 class Database:
     """Database connection manager"""
     
-    def __init__(self):
+    def __init__(self, dsn: Optional[str] = None, min_size: int = 5, max_size: int = 20):
+        self.dsn = dsn or settings.DATABASE_URL
+        self.min_size = min_size
+        self.max_size = max_size
         self.pool: Optional[asyncpg.Pool] = None
     
     async def connect(self):
         """Create database connection pool"""
         if not self.pool:
             self.pool = await asyncpg.create_pool(
-                settings.DATABASE_URL,
-                min_size=5,
-                max_size=20,
-                command_timeout=60
+                self.dsn,
+                min_size=self.min_size,
+                max_size=self.max_size,
+                command_timeout=60,
+                # Each connection keeps prepared statements keyed by query text;
+                # service queries use fixed strings so they are parsed once per connection
+                statement_cache_size=256,
+                # Timestamp columns are naive UTC; with the session in UTC,
+                # CURRENT_TIMESTAMP (and column defaults/triggers) store UTC too
+                server_settings={"timezone": "UTC"}
             )
             print("✅ Database connection pool created")
     
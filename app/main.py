@@ -2,9 +2,13 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 from contextlib import asynccontextmanager
+import asyncio
 
 from app.core.config import settings
 from app.api.v1 import auth, users, mfa
+from app.services.email_service import EmailService
+from app.services.user_service import pwd_context
+from app.services.firebase_service import ensure_firebase_initialized
 
 # Security scheme for JWT Bearer tokens
 security = HTTPBearer()
@@ -14,9 +18,18 @@ async def lifespan(app: FastAPI):
     """Application lifespan events"""
     # Startup
     print("🚀 Starting Personal Finance Manager API...")
+    # Load the bcrypt backend now rather than on the first login
+    await asyncio.to_thread(pwd_context.dummy_verify)
+    if settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH or settings.FIREBASE_SERVICE_ACCOUNT_JSON:
+        try:
+            ensure_firebase_initialized()
+        except Exception as e:
+            # Firebase login will report the error; the rest of the API still works
+            print(f"⚠️ {e}")
     yield
     # Shutdown
     print("🛑 Shutting down Personal Finance Manager API...")
+    await EmailService.close()
 
 
 # Create FastAPI application
@@ -1,10 +1,109 @@
-from pydantic import BaseModel, EmailStr, ConfigDict, Field, field_validator
-from typing import Optional
+from pydantic import AfterValidator, BaseModel, EmailStr, ConfigDict, Field, field_validator
+from typing import Annotated, Optional
 from uuid import UUID
 from datetime import datetime
+import functools
+import operator
 import re
 
 
+# Character classes required in a password, as bit flags
+_UPPER, _LOWER, _DIGIT, _SPECIAL = 1, 2, 4, 8
+_SPECIAL_CHARS = '!@#$%^&*(),.?":{}|<>'
+
+# Basic phone validation - allows digits, spaces, hyphens, and parentheses
+_PHONE_PATTERN = re.compile(r'^\+[\d\s\-\(\)]+$')
+
+# Byte -> character class lookup table for ASCII passwords
+_CLASS_TABLE = bytes(
+    _UPPER if 65 <= i <= 90 else _LOWER if 97 <= i <= 122 else _DIGIT if 48 <= i <= 57
+    else _SPECIAL if chr(i) in _SPECIAL_CHARS else 0
+    for i in range(256)
+)
+
+
+# OpenAPI request examples
+_USER_CREATE_EXAMPLE = {
+    "full_name": "John Doe",
+    "email": "john@example.com",
+    "phone": "+37412345678",
+    "password": "SecurePass123!",
+    "user_type": "individual",
+    "language_preference": "hy",
+    "currency_preference": "AMD"
+}
+
+_USER_LOGIN_EXAMPLE = {
+    "email": "john@example.com",
+    "password": "SecurePass123!"
+}
+
+_USER_UPDATE_EXAMPLE = {
+    "full_name": "John Doe",
+    "phone": "+37412345678",
+    "language_preference": "hy",
+    "currency_preference": "AMD",
+    "profile_picture": "https://example.com/profile.jpg"
+}
+
+_EMAIL_VERIFICATION_EXAMPLE = {
+    "token": "550e8400-e29b-41d4-a716-446655440000"
+}
+
+_RESEND_VERIFICATION_EXAMPLE = {
+    "email": "john@example.com"
+}
+
+
+def _password_char_classes(password: str) -> int:
+    """Return the bit mask of character classes present in a password"""
+    try:
+        return functools.reduce(operator.or_, password.encode('ascii').translate(_CLASS_TABLE), 0)
+    except UnicodeEncodeError:
+        # Non-ASCII passwords fall back to the regex checks
+        flags = 0
+        if re.search(r'[A-Z]', password):
+            flags |= _UPPER
+        if re.search(r'[a-z]', password):
+            flags |= _LOWER
+        if re.search(r'\d', password):
+            flags |= _DIGIT
+        if re.search(r'[!@#$%^&*(),.?":{}|<>]', password):
+            flags |= _SPECIAL
+        return flags
+
+
+# Profile picture URL validation
+_URL_PATTERN = re.compile(
+    r'^https?://'  # http:// or https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
+    r'localhost|'  # localhost...
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
+    r'(?::\d+)?'  # optional port
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE)
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg')
+
+
+def _validate_profile_picture(v: str) -> str:
+    """Validate profile picture URL"""
+    url = v.strip()
+    if not url:
+        raise ValueError("Profile picture URL cannot be empty")
+    
+    # Basic URL validation
+    if not _URL_PATTERN.match(url):
+        raise ValueError("Profile picture must be a valid URL")
+    
+    # Check for common image file extensions
+    if not url.lower().endswith(_IMAGE_EXTENSIONS):
+        raise ValueError("Profile picture URL must end with a valid image extension (.jpg, .jpeg, .png, .gif, .webp, .svg)")
+    
+    return url
+
+
+ProfilePictureURL = Annotated[str, AfterValidator(_validate_profile_picture)]
+
+
 class UserCreate(BaseModel):
     """Schema for user registration"""
     full_name: str = Field(..., min_length=2, max_length=50, description="User's full name")
@@ -29,20 +128,22 @@ class UserCreate(BaseModel):
         if len(v) > 128:
             raise ValueError("Password must be no more than 128 characters long")
         
+        flags = _password_char_classes(v)
+        
         # Check for at least one uppercase letter
-        if not re.search(r'[A-Z]', v):
+        if not flags & _UPPER:
             raise ValueError("Password must contain at least one uppercase letter")
         
         # Check for at least one lowercase letter
-        if not re.search(r'[a-z]', v):
+        if not flags & _LOWER:
             raise ValueError("Password must contain at least one lowercase letter")
         
         # Check for at least one digit
-        if not re.search(r'\d', v):
+        if not flags & _DIGIT:
             raise ValueError("Password must contain at least one digit")
         
         # Check for at least one special character
-        if not re.search(r'[!@#$%^&*(),.?":{}|<>]', v):
+        if not flags & _SPECIAL:
             raise ValueError("Password must contain at least one special character (!@#$%^&*(),.?\":{}|<>)")
         
         return v
@@ -66,33 +167,23 @@ class UserCreate(BaseModel):
         if not v or v.strip() == "":
             raise ValueError("Phone number cannot be empty")
         
+        phone = v.strip()
+        
         # Phone number must start with +
-        if not v.strip().startswith('+'):
+        if not phone.startswith('+'):
             raise ValueError("Phone number must start with +")
         
         # Check minimum length (excluding the + sign)
-        if len(v.strip()) < 8:
+        if len(phone) < 8:
             raise ValueError("Phone number must be between 8 and 20 characters long")
         
         # Basic phone validation - allows digits, spaces, hyphens, and parentheses
-        if not re.match(r'^\+[\d\s\-\(\)]+$', v):
+        if not _PHONE_PATTERN.match(v):
             raise ValueError("Phone number contains invalid characters")
         
-        return v.strip()
+        return phone
     
-    model_config = ConfigDict(
-        json_schema_extra={
-            "example": {
-                "full_name": "John Doe",
-                "email": "john@example.com",
-                "phone": "+37412345678",
-                "password": "SecurePass123!",
-                "user_type": "individual",
-                "language_preference": "hy",
-                "currency_preference": "AMD"
-            }
-        }
-    )
+    model_config = ConfigDict(json_schema_extra={"example": _USER_CREATE_EXAMPLE})
 
 
 class UserLogin(BaseModel):
@@ -109,14 +200,7 @@ class UserLogin(BaseModel):
             raise ValueError("Password cannot be empty")
         return v
     
-    model_config = ConfigDict(
-        json_schema_extra={
-            "example": {
-                "email": "john@example.com",
-                "password": "SecurePass123!"
-            }
-        }
-    )
+    model_config = ConfigDict(json_schema_extra={"example": _USER_LOGIN_EXAMPLE})
 
 
 class UserUpdate(BaseModel):
@@ -125,7 +209,7 @@ class UserUpdate(BaseModel):
     phone: Optional[str] = Field(None, min_length=8, max_length=20, description="User's phone number")
     language_preference: Optional[str] = Field(None, pattern="^(hy|en|ru)$", description="Language preference")
     currency_preference: Optional[str] = Field(None, pattern="^(AMD|USD|EUR|RUB)$", description="Currency preference")
-    profile_picture: Optional[str] = Field(None, description="URL to user's profile picture")
+    profile_picture: Optional[ProfilePictureURL] = Field(None, description="URL to user's profile picture")
     
     @field_validator('full_name')
     @classmethod
@@ -149,61 +233,24 @@ class UserUpdate(BaseModel):
             if not v or v.strip() == "":
                 raise ValueError("Phone number cannot be empty")
             
+            phone = v.strip()
+            
             # Phone number must start with +
-            if not v.strip().startswith('+'):
+            if not phone.startswith('+'):
                 raise ValueError("Phone number must start with +")
             
             # Check minimum length (excluding the + sign)
-            if len(v.strip()) < 8:
+            if len(phone) < 8:
                 raise ValueError("Phone number must be between 8 and 20 characters long")
             
             # Basic phone validation - allows digits, spaces, hyphens, and parentheses
-            if not re.match(r'^\+[\d\s\-\(\)]+$', v):
+            if not _PHONE_PATTERN.match(v):
                 raise ValueError("Phone number contains invalid characters")
             
-            return v.strip()
+            return phone
         return v
     
-    @field_validator('profile_picture')
-    @classmethod
-    def validate_profile_picture(cls, v):
-        """Validate profile picture URL"""
-        if v is not None:
-            if not v or v.strip() == "":
-                raise ValueError("Profile picture URL cannot be empty")
-            
-            # Basic URL validation
-            import re
-            url_pattern = re.compile(
-                r'^https?://'  # http:// or https://
-                r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+[A-Z]{2,6}\.?|'  # domain...
-                r'localhost|'  # localhost...
-                r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-                r'(?::\d+)?'  # optional port
-                r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-            
-            if not url_pattern.match(v.strip()):
-                raise ValueError("Profile picture must be a valid URL")
-            
-            # Check for common image file extensions
-            image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg']
-            if not any(v.lower().endswith(ext) for ext in image_extensions):
-                raise ValueError("Profile picture URL must end with a valid image extension (.jpg, .jpeg, .png, .gif, .webp, .svg)")
-            
-            return v.strip()
-        return v
-    
-    model_config = ConfigDict(
-        json_schema_extra={
-            "example": {
-                "full_name": "John Doe",
-                "phone": "+37412345678",
-                "language_preference": "hy",
-                "currency_preference": "AMD",
-                "profile_picture": "https://example.com/profile.jpg"
-            }
-        }
-    )
+    model_config = ConfigDict(json_schema_extra={"example": _USER_UPDATE_EXAMPLE})
 
 
 class UserResponse(BaseModel):
@@ -223,6 +270,9 @@ class UserResponse(BaseModel):
     mfa_enabled: bool
     created_at: datetime
     updated_at: datetime
+    
+    # Built straight from full users rows, so unknown columns are ignored rather than forbidden
+    model_config = ConfigDict(from_attributes=True, frozen=True)
 
 
 class TokenResponse(BaseModel):
@@ -233,6 +283,8 @@ class TokenResponse(BaseModel):
     expires_in: int
     mfa_session_token: Optional[str] = None
     user: Optional[dict] = None  # User data when authentication is successful
+    
+    model_config = ConfigDict(from_attributes=True, extra='forbid', frozen=True)
 
 
 class RefreshTokenRequest(BaseModel):
@@ -244,13 +296,7 @@ class EmailVerificationRequest(BaseModel):
     """Schema for email verification request"""
     token: str
     
-    model_config = ConfigDict(
-        json_schema_extra={
-            "example": {
-                "token": "550e8400-e29b-41d4-a716-446655440000"
-            }
-        }
-    )
+    model_config = ConfigDict(json_schema_extra={"example": _EMAIL_VERIFICATION_EXAMPLE})
 
 
 class EmailVerificationResponse(BaseModel):
@@ -263,13 +309,7 @@ class ResendVerificationRequest(BaseModel):
     """Schema for resend verification email request"""
     email: EmailStr
     
-    model_config = ConfigDict(
-        json_schema_extra={
-            "example": {
-                "email": "john@example.com"
-            }
-        }
-    )
+    model_config = ConfigDict(json_schema_extra={"example": _RESEND_VERIFICATION_EXAMPLE})
 
 
 class ResendVerificationResponse(BaseModel):
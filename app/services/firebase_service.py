@@ -1,13 +1,98 @@
+import json
+import os
+import threading
 import firebase_admin
 from firebase_admin import auth, credentials
-from typing import Optional, Dict, Any
+from typing import Dict, Any
 from app.core.config import settings
 from app.core.database import Database
 from app.services.user_service import UserService
 from app.utils.jwt import JWTManager
 from app.services.mfa_service import MFAService
 import uuid
-from datetime import datetime
+
+
+# Columns needed for the login response and the MFA status check
+FIREBASE_USER_COLUMNS = """
+    id, full_name, email, phone, user_type, language_preference,
+    currency_preference, profile_picture, registration_date, last_login,
+    profile_status, email_verified, mfa_enabled, created_at, updated_at,
+    firebase_uid, totp_enabled, email_mfa_enabled, backup_codes_encrypted,
+    backup_codes_remaining
+"""
+
+# Match the account already linked to this Firebase UID, otherwise create the user
+# or link Firebase to the account with this email, recording the login either way.
+# Constant columns are SQL literals and registration_date uses the column default.
+FIND_OR_CREATE_FIREBASE_USER_QUERY = f"""
+WITH by_uid AS (
+    UPDATE users 
+    SET last_login = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+    WHERE firebase_uid = $5 AND deleted_at IS NULL
+    RETURNING {FIREBASE_USER_COLUMNS}
+), upserted AS (
+    INSERT INTO users (
+        id, full_name, email, phone, user_type, language_preference, 
+        currency_preference, profile_picture, firebase_uid, oauth_provider,
+        profile_status, email_verified, last_login
+    )
+    SELECT $1::uuid, $2::text, $3::text, '+0000000000', 'individual', 'en', 'USD',
+           $4::text, $5, 'firebase', 'active', $6::boolean, CURRENT_TIMESTAMP
+    WHERE NOT EXISTS (SELECT 1 FROM by_uid)
+    ON CONFLICT (email) DO UPDATE
+    SET firebase_uid = EXCLUDED.firebase_uid, oauth_provider = 'firebase',
+        last_login = EXCLUDED.last_login, updated_at = CURRENT_TIMESTAMP
+    WHERE users.deleted_at IS NULL
+    RETURNING {FIREBASE_USER_COLUMNS}
+)
+SELECT * FROM by_uid
+UNION ALL
+SELECT * FROM upserted
+LIMIT 1
+"""
+
+
+_firebase_initialized = False
+_firebase_init_lock = threading.Lock()
+
+
+def ensure_firebase_initialized() -> None:
+    """Initialize the Firebase Admin SDK once per process"""
+    global _firebase_initialized
+    if _firebase_initialized:
+        return
+    
+    with _firebase_init_lock:
+        if _firebase_initialized:
+            return
+        
+        if not firebase_admin._apps:
+            cred = None
+            key_path = settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH
+            if key_path and os.path.isfile(key_path):
+                # Load service account key from file
+                try:
+                    cred = credentials.Certificate(key_path)
+                except Exception as e:
+                    # Fall through to the environment variable
+                    print(f"DEBUG: Failed to load Firebase service account from file: {e}")
+
+            if cred is None:
+                # Fall back to the environment variable
+                if not settings.FIREBASE_SERVICE_ACCOUNT_JSON:
+                    raise Exception(
+                        "Failed to initialize Firebase: no usable service account file and "
+                        "FIREBASE_SERVICE_ACCOUNT_JSON environment variable is not set"
+                    )
+                try:
+                    cred = credentials.Certificate(json.loads(settings.FIREBASE_SERVICE_ACCOUNT_JSON))
+                except Exception as e:
+                    raise Exception(f"Failed to initialize Firebase: {e}")
+            
+            firebase_admin.initialize_app(cred)
+            print("✅ Firebase Admin SDK initialized")
+        
+        _firebase_initialized = True
 
 
 class FirebaseService:
@@ -19,34 +104,7 @@ class FirebaseService:
         self.mfa_service = MFAService(db)
         
         # Initialize Firebase Admin SDK if not already initialized
-        if not firebase_admin._apps:
-            print(f"DEBUG: Initializing Firebase Admin SDK")
-            print(f"DEBUG: FIREBASE_SERVICE_ACCOUNT_KEY_PATH = {settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH}")
-            print(f"DEBUG: FIREBASE_SERVICE_ACCOUNT_JSON exists = {settings.FIREBASE_SERVICE_ACCOUNT_JSON is not None}")
-            if settings.FIREBASE_SERVICE_ACCOUNT_JSON:
-                print(f"DEBUG: FIREBASE_SERVICE_ACCOUNT_JSON length = {len(settings.FIREBASE_SERVICE_ACCOUNT_JSON)}")
-            
-            try:
-                # Try to load service account key from file
-                print(f"DEBUG: Trying to load Firebase service account from file...")
-                cred = credentials.Certificate(settings.FIREBASE_SERVICE_ACCOUNT_KEY_PATH)
-                firebase_admin.initialize_app(cred)
-                print(f"DEBUG: Firebase initialized from file successfully")
-            except Exception as e:
-                print(f"DEBUG: Failed to load from file: {e}")
-                # If file not found, try to use environment variable
-                try:
-                    print(f"DEBUG: Trying to load Firebase service account from environment variable...")
-                    import json
-                    if not settings.FIREBASE_SERVICE_ACCOUNT_JSON:
-                        raise Exception("FIREBASE_SERVICE_ACCOUNT_JSON environment variable is not set")
-                    service_account_info = json.loads(settings.FIREBASE_SERVICE_ACCOUNT_JSON)
-                    cred = credentials.Certificate(service_account_info)
-                    firebase_admin.initialize_app(cred)
-                    print(f"DEBUG: Firebase initialized from environment variable successfully")
-                except Exception as e2:
-                    print(f"DEBUG: Failed to initialize from environment variable: {e2}")
-                    raise Exception(f"Failed to initialize Firebase: {e2}")
+        ensure_firebase_initialized()
     
     async def verify_firebase_token(self, id_token: str) -> Dict[str, Any]:
         """Verify Firebase ID token and return user info"""
@@ -72,78 +130,20 @@ class FirebaseService:
     async def find_or_create_user(self, firebase_user_info: Dict[str, Any]) -> Dict[str, Any]:
         """Find existing user or create new one from Firebase data"""
         firebase_uid = firebase_user_info["uid"]
-        email = firebase_user_info["email"]
-        
-        # First, try to find user by Firebase UID
-        user = await self.get_user_by_firebase_uid(firebase_uid)
-        if user:
-            return user
-        
-        # Then, try to find user by email
-        user = await self.user_service.get_user_by_email(email)
-        if user:
-            # Link Firebase account to existing email account
-            await self.link_firebase_account(user["id"], firebase_uid)
-            # Fetch and return the updated user
-            user = await self.user_service.get_user_by_email(email)
-            return user
-        
-        # Create new user from Firebase data
-        return await self.create_user_from_firebase(firebase_user_info)
-    
-    async def get_user_by_firebase_uid(self, firebase_uid: str) -> Optional[Dict[str, Any]]:
-        """Get user by Firebase UID"""
-        query = """
-        SELECT * FROM users 
-        WHERE firebase_uid = $1 AND deleted_at IS NULL
-        """
-        result = await self.db.fetchrow(query, firebase_uid)
-        return dict(result) if result else None
-    
-    async def link_firebase_account(self, user_id: uuid.UUID, firebase_uid: str) -> None:
-        """Link Firebase account to existing user"""
-        query = """
-        UPDATE users 
-        SET firebase_uid = $1, oauth_provider = 'firebase', updated_at = $2
-        WHERE id = $3
-        """
-        await self.db.execute(query, firebase_uid, datetime.utcnow(), user_id)
-    
-    async def create_user_from_firebase(self, firebase_user_info: Dict[str, Any]) -> Dict[str, Any]:
-        """Create a new user from Firebase data"""
-        user_id = uuid.uuid4()
-        firebase_uid = firebase_user_info["uid"]
-        email = firebase_user_info["email"]
-        full_name = firebase_user_info.get("name", "Unknown")
-        picture = firebase_user_info.get("picture")
-        
-        # Create user with Firebase data
-        query = """
-        INSERT INTO users (
-            id, full_name, email, phone, user_type, language_preference, 
-            currency_preference, profile_picture, firebase_uid, oauth_provider,
-            profile_status, email_verified, registration_date
-        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
-        RETURNING *
-        """
         
         result = await self.db.fetchrow(
-            query,
-            user_id,
-            full_name,
-            email,
-            "+0000000000",  # Default phone for OAuth users
-            "individual",   # Default user type
-            "en",          # Default language
-            "USD",         # Default currency
-            picture,
+            FIND_OR_CREATE_FIREBASE_USER_QUERY,
+            uuid.uuid4(),
+            firebase_user_info.get("name", "Unknown"),
+            firebase_user_info["email"],
+            firebase_user_info.get("picture"),
             firebase_uid,
-            "firebase",
-            "active",      # OAuth users are automatically verified
-            firebase_user_info.get("email_verified", True),  # Email is verified by Firebase
-            datetime.utcnow()
+            firebase_user_info.get("email_verified", True)  # Email is verified by Firebase
         )
         
+        if not result:
+            raise ValueError("User account has been deleted")
+        
         return dict(result)
     
     async def handle_firebase_login(self, id_token: str) -> Dict[str, Any]:
@@ -151,14 +151,11 @@ class FirebaseService:
         # Verify Firebase token
         firebase_user_info = await self.verify_firebase_token(id_token)
         
-        # Find or create user
+        # Find or create user (this also records the login)
         user = await self.find_or_create_user(firebase_user_info)
         
-        # Update last login
-        await self.user_service.update_last_login(user["id"])
-        
-        # Check MFA status
-        mfa_status = await self.mfa_service.get_mfa_status(user["id"])
+        # Check MFA status from the returned row
+        mfa_status = await self.mfa_service.get_mfa_status(user["id"], user=user)
         
         if mfa_status["mfa_required"]:
             # User has MFA enabled, return temporary token
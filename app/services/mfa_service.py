@@ -1,15 +1,34 @@
+import functools
 import uuid
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from passlib.context import CryptContext
+import hashlib
+import hmac
+import logging
+import secrets
+from typing import Optional, Dict, Any, Mapping, Tuple
+from asyncpg import Record
+from app.core.config import settings
 from app.core.database import Database
 from app.utils.totp import TOTPManager, TOTPEncryption
 from app.schemas.mfa import TOTPSetupResponse
 from app.services.email_service import EmailService
 
 
-# Password hashing context for email MFA codes
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
+
+# Shared across requests; both are stateless once configured
+_totp_encryption = TOTPEncryption()
+_email_service = EmailService()
+
+
+@functools.lru_cache(maxsize=None)
+def _update_user_fields_query(columns: Tuple[str, ...]) -> str:
+    """Build (once per column set) the UPDATE used by _update_user_fields"""
+    assignments = ", ".join(f"{column} = ${i}" for i, column in enumerate(columns, start=1))
+    return f"""
+    UPDATE users 
+    SET {assignments}, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ${len(columns) + 1}
+    """
 
 
 class MFAService:
@@ -17,8 +36,15 @@ class MFAService:
     
     def __init__(self, db: Database):
         self.db = db
-        self.totp_encryption = TOTPEncryption()
-        self.email_service = EmailService()
+        self.totp_encryption = _totp_encryption
+        self.email_service = _email_service
+        self._mfa_key = settings.MFA_HMAC_KEY.encode()
+        # MFA columns fetched during this service's lifetime (one request)
+        self._user_cache: Dict[uuid.UUID, Record] = {}
+    
+    def _hash_email_mfa_code(self, code: str) -> str:
+        """Hash a short-lived email MFA code with HMAC-SHA256"""
+        return hmac.new(self._mfa_key, code.encode(), hashlib.sha256).hexdigest()
     
     # TOTP MFA Methods
     
@@ -33,16 +59,16 @@ class MFAService:
         encrypted_backup_codes = self.totp_encryption.encrypt_backup_codes(backup_codes)
         
         # Store encrypted secret and backup codes (but don't enable yet)
-        query = """
-        UPDATE users 
-        SET totp_secret_encrypted = $1, backup_codes_encrypted = $2, updated_at = $3
-        WHERE id = $4
-        """
-        await self.db.execute(query, encrypted_secret, encrypted_backup_codes, datetime.utcnow(), user_id)
+        await self._update_user_fields(
+            user_id,
+            totp_secret_encrypted=encrypted_secret,
+            backup_codes_encrypted=encrypted_backup_codes,
+            backup_codes_remaining=len(backup_codes)
+        )
         
         # Generate QR code URL and image
         qr_code_url = TOTPManager.generate_qr_code(secret, email)
-        qr_code_image = TOTPManager.generate_qr_code_image(secret, email)
+        qr_code_image = TOTPManager.render_qr_code_image(qr_code_url)
         
         return TOTPSetupResponse(
             qr_code_url=qr_code_url,
@@ -54,7 +80,7 @@ class MFAService:
     async def verify_totp_setup(self, user_id: uuid.UUID, code: str) -> bool:
         """Verify TOTP code during setup and enable TOTP"""
         # Get encrypted secret
-        user = await self.get_user_by_id(user_id)
+        user = await self._get_user_mfa_fields(user_id)
         if not user or not user.get("totp_secret_encrypted"):
             return False
         
@@ -66,18 +92,13 @@ class MFAService:
             return False
         
         # Enable TOTP
-        query = """
-        UPDATE users 
-        SET totp_enabled = TRUE, updated_at = $1
-        WHERE id = $2
-        """
-        await self.db.execute(query, datetime.utcnow(), user_id)
+        await self._update_user_fields(user_id, totp_enabled=True)
         
         return True
     
     async def verify_totp_login(self, user_id: uuid.UUID, code: str) -> bool:
         """Verify TOTP code during login"""
-        user = await self.get_user_by_id(user_id)
+        user = await self._get_user_mfa_fields(user_id)
         if not user or not user.get("totp_enabled") or not user.get("totp_secret_encrypted"):
             return False
         
@@ -94,39 +115,37 @@ class MFAService:
             return False
         
         # Disable TOTP and clear secrets
-        query = """
-        UPDATE users 
-        SET totp_enabled = FALSE, totp_secret_encrypted = NULL, 
-            backup_codes_encrypted = NULL, updated_at = $1
-        WHERE id = $2
-        """
-        await self.db.execute(query, datetime.utcnow(), user_id)
+        await self._update_user_fields(
+            user_id,
+            totp_enabled=False,
+            totp_secret_encrypted=None,
+            backup_codes_encrypted=None,
+            backup_codes_remaining=0
+        )
         
         return True
     
     async def verify_backup_code(self, user_id: uuid.UUID, code: str) -> bool:
         """Verify a backup code and mark it as used"""
-        user = await self.get_user_by_id(user_id)
+        user = await self._get_user_mfa_fields(user_id)
         if not user or not user.get("backup_codes_encrypted"):
             return False
         
-        # Decrypt backup codes
-        backup_codes = self.totp_encryption.decrypt_backup_codes(user["backup_codes_encrypted"])
+        # Decrypt backup codes into a set for O(1) lookup and removal
+        backup_codes = set(self.totp_encryption.decrypt_backup_codes(user["backup_codes_encrypted"]))
         
         # Check if code exists
         if code not in backup_codes:
             return False
         
         # Remove the used code and update
-        backup_codes.remove(code)
-        encrypted_backup_codes = self.totp_encryption.encrypt_backup_codes(backup_codes)
-        
-        query = """
-        UPDATE users 
-        SET backup_codes_encrypted = $1, updated_at = $2
-        WHERE id = $3
-        """
-        await self.db.execute(query, encrypted_backup_codes, datetime.utcnow(), user_id)
+        backup_codes.discard(code)
+        encrypted_backup_codes = self.totp_encryption.encrypt_backup_codes(list(backup_codes))
+        await self._update_user_fields(
+            user_id,
+            backup_codes_encrypted=encrypted_backup_codes,
+            backup_codes_remaining=len(backup_codes)
+        )
         
         return True
     
@@ -134,34 +153,28 @@ class MFAService:
     
     async def send_email_mfa_code(self, user_id: uuid.UUID, email: str) -> str:
         """Send email MFA code and store it"""
-        print(f"DEBUG: send_email_mfa_code called for user_id: {user_id}, email: {email}")
+        logger.debug("send_email_mfa_code user_id=%s email=%s", user_id, email)
         
         # Check if email MFA is enabled for this user
-        user = await self.get_user_by_id(user_id)
+        user = await self._get_user_mfa_fields(user_id)
         if not user:
-            print(f"DEBUG: User not found: {user_id}")
+            logger.debug("send_email_mfa_code user not found user_id=%s", user_id)
             raise ValueError("User not found")
         
-        print(f"DEBUG: User email_mfa_enabled: {user.get('email_mfa_enabled')}")
-        
         if not user.get("email_mfa_enabled"):
-            print(f"DEBUG: Email MFA not enabled for user: {user_id}")
+            logger.debug("send_email_mfa_code email MFA not enabled user_id=%s", user_id)
             raise ValueError("Email MFA is not enabled for this user")
         
         # Generate 6-digit code
-        code = ''.join([str(uuid.uuid4().int % 10) for _ in range(6)])
-        code_hash = pwd_context.hash(code)
-        
-        print(f"DEBUG: Generated code: {code}")
+        code = f"{secrets.randbelow(1_000_000):06d}"
+        code_hash = self._hash_email_mfa_code(code)
         
         # Store code with expiration (5 minutes)
-        expires_at = datetime.utcnow() + timedelta(minutes=5)
-        
         query = """
         INSERT INTO email_mfa_codes (user_id, code_hash, expires_at)
-        VALUES ($1, $2, $3)
+        VALUES ($1, $2, CURRENT_TIMESTAMP + INTERVAL '5 minutes')
         """
-        await self.db.execute(query, user_id, code_hash, expires_at)
+        await self.db.execute(query, user_id, code_hash)
         
         # Get user name for email
         user_name = user.get("full_name") if user else None
@@ -171,7 +184,7 @@ class MFAService:
         
         if not email_sent:
             # If email fails, still return code for testing in development
-            print(f"Failed to send email, returning code for testing: {code}")
+            logger.warning("Failed to send email MFA code user_id=%s", user_id)
         
         # In development mode, always return the code for testing
         # In production, you might want to return a success message instead
@@ -179,51 +192,31 @@ class MFAService:
     
     async def verify_email_mfa_code(self, user_id: uuid.UUID, code: str) -> bool:
         """Verify email MFA code"""
-        # Get the most recent unused code
+        # Only the most recent unused code is valid; match and mark it as used in one statement
         query = """
-        SELECT code_hash, expires_at, used
-        FROM email_mfa_codes 
-        WHERE user_id = $1 AND used = FALSE AND expires_at > $2
-        ORDER BY created_at DESC 
-        LIMIT 1
-        """
-        result = await self.db.fetchrow(query, user_id, datetime.utcnow())
-        
-        if not result:
-            return False
-        
-        # Verify code
-        if not pwd_context.verify(code, result["code_hash"]):
-            return False
-        
-        # Mark code as used
-        update_query = """
-        UPDATE email_mfa_codes 
-        SET used = TRUE 
-        WHERE user_id = $1 AND code_hash = $2
+        UPDATE email_mfa_codes
+        SET used = TRUE
+        WHERE id = (
+            SELECT id
+            FROM email_mfa_codes
+            WHERE user_id = $1 AND used = FALSE AND expires_at > CURRENT_TIMESTAMP
+            ORDER BY created_at DESC
+            LIMIT 1
+        ) AND code_hash = $2
+        RETURNING id
         """
-        await self.db.execute(update_query, user_id, result["code_hash"])
+        result = await self.db.fetchval(query, user_id, self._hash_email_mfa_code(code))
         
-        return True
+        return result is not None
     
     async def enable_email_mfa(self, user_id: uuid.UUID) -> bool:
         """Enable email MFA for a user"""
-        query = """
-        UPDATE users 
-        SET email_mfa_enabled = TRUE, updated_at = $1
-        WHERE id = $2
-        """
-        await self.db.execute(query, datetime.utcnow(), user_id)
+        await self._update_user_fields(user_id, email_mfa_enabled=True)
         return True
     
     async def disable_email_mfa(self, user_id: uuid.UUID) -> bool:
         """Disable email MFA for a user"""
-        query = """
-        UPDATE users 
-        SET email_mfa_enabled = FALSE, updated_at = $1
-        WHERE id = $2
-        """
-        await self.db.execute(query, datetime.utcnow(), user_id)
+        await self._update_user_fields(user_id, email_mfa_enabled=False)
         return True
     
     async def verify_totp(self, user_id: uuid.UUID, code: str) -> bool:
@@ -240,29 +233,52 @@ class MFAService:
 
     # Utility Methods
     
-    async def get_user_by_id(self, user_id: uuid.UUID) -> Optional[Dict[str, Any]]:
-        """Get user by ID"""
+    async def _get_user_mfa_fields(self, user_id: uuid.UUID) -> Optional[Record]:
+        """Get the MFA columns of a user, cached for the lifetime of this service"""
+        if user_id in self._user_cache:
+            return self._user_cache[user_id]
+        
         query = """
-        SELECT * FROM users 
+        SELECT id, full_name, totp_enabled, totp_secret_encrypted,
+               backup_codes_encrypted, backup_codes_remaining, email_mfa_enabled
+        FROM users 
         WHERE id = $1 AND deleted_at IS NULL
         """
-        result = await self.db.fetchrow(query, user_id)
-        return dict(result) if result else None
+        # Only read by the MFA methods, so the asyncpg Record is cached as-is
+        user = await self.db.fetchrow(query, user_id)
+        if user is not None:
+            self._user_cache[user_id] = user
+        return user
+    
+    def _invalidate_user(self, user_id: uuid.UUID) -> None:
+        """Drop a cached user row after it has been modified"""
+        self._user_cache.pop(user_id, None)
+    
+    async def _update_user_fields(self, user_id: uuid.UUID, **fields: Any) -> None:
+        """Update MFA columns of a user and bump updated_at"""
+        # Sorted columns keep the SQL text stable for asyncpg's statement cache
+        columns = tuple(sorted(fields))
+        await self.db.execute(_update_user_fields_query(columns), *(fields[column] for column in columns), user_id)
+        self._invalidate_user(user_id)
     
-    async def get_mfa_status(self, user_id: uuid.UUID) -> Dict[str, bool]:
-        """Get MFA status for a user"""
-        user = await self.get_user_by_id(user_id)
+    async def get_mfa_status(self, user_id: uuid.UUID, user: Optional[Mapping[str, Any]] = None) -> Dict[str, bool]:
+        """Get MFA status for a user, reusing an already-fetched user row if given"""
+        if user is None:
+            user = await self._get_user_mfa_fields(user_id)
         if not user:
             return {"totp_enabled": False, "email_mfa_enabled": False, "mfa_required": False, "backup_codes_remaining": 0}
         
-        # Count backup codes if TOTP is enabled
+        # Count backup codes if TOTP is enabled, using the stored count when present
         backup_codes_remaining = 0
         if user.get("totp_enabled") and user.get("backup_codes_encrypted"):
-            try:
-                backup_codes = self.totp_encryption.decrypt_backup_codes(user["backup_codes_encrypted"])
-                backup_codes_remaining = len(backup_codes)
-            except:
-                backup_codes_remaining = 0
+            backup_codes_remaining = user.get("backup_codes_remaining")
+            if backup_codes_remaining is None:
+                # Rows written before the count column existed
+                try:
+                    backup_codes = self.totp_encryption.decrypt_backup_codes(user["backup_codes_encrypted"])
+                    backup_codes_remaining = len(backup_codes)
+                except:
+                    backup_codes_remaining = 0
         
         return {
             "totp_enabled": user.get("totp_enabled", False),
@@ -277,4 +293,4 @@ class MFAService:
         INSERT INTO mfa_attempts (user_id, method, success, ip_address, user_agent)
         VALUES ($1, $2, $3, $4, $5)
         """
-        await self.db.execute(query, user_id, method, success, ip_address, user_agent) 
\ No newline at end of file
+        await self.db.execute(query, user_id, method, success, ip_address, user_agent) 
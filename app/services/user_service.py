@@ -1,14 +1,47 @@
+import asyncio
+import hashlib
+import logging
 import uuid
-from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
+from asyncpg import Record
+from fastapi import BackgroundTasks
 from passlib.context import CryptContext
+from app.core.config import settings
 from app.core.database import Database
 from app.schemas.user import UserCreate, UserUpdate, UserResponse
 from app.services.email_service import EmailService
 
 
+logger = logging.getLogger(__name__)
+
 # Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+pwd_context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=settings.BCRYPT_ROUNDS, deprecated="auto")
+
+# Shared across requests; stateless once configured
+_email_service = EmailService()
+
+# Columns needed to authenticate a user and build the login response (incl. MFA status)
+AUTH_USER_COLUMNS = """
+    id, email, full_name, user_type, password_hash, profile_status, email_verified,
+    account_locked_until, failed_login_attempts, totp_enabled, email_mfa_enabled,
+    backup_codes_encrypted, backup_codes_remaining,
+    COALESCE(account_locked_until > CURRENT_TIMESTAMP, FALSE) AS account_locked
+"""
+
+GET_AUTH_USER_QUERY = f"""
+SELECT {AUTH_USER_COLUMNS} FROM users 
+WHERE email = $1 AND deleted_at IS NULL
+"""
+
+def hash_refresh_token(refresh_token: str) -> str:
+    """Hash a refresh token for storage and lookup in user_sessions"""
+    return hashlib.sha256(refresh_token.encode()).hexdigest()
+
+
+# Columns a user may change through a profile update
+UPDATABLE_USER_COLUMNS = frozenset({
+    "full_name", "phone", "language_preference", "currency_preference", "profile_picture"
+})
 
 
 class UserService:
@@ -16,41 +49,31 @@ class UserService:
     
     def __init__(self, db: Database):
         self.db = db
-        self.email_service = EmailService()
+        self.email_service = _email_service
     
-    def hash_password(self, password: str) -> str:
-        """Hash a password using bcrypt"""
-        return pwd_context.hash(password)
+    async def hash_password(self, password: str) -> str:
+        """Hash a password using bcrypt (in a worker thread)"""
+        return await asyncio.to_thread(pwd_context.hash, password)
     
-    def verify_password(self, plain_password: str, hashed_password: str) -> bool:
-        """Verify a password against its hash"""
-        return pwd_context.verify(plain_password, hashed_password)
+    async def verify_password(self, plain_password: str, hashed_password: str) -> bool:
+        """Verify a password against its hash (in a worker thread)"""
+        return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
     
     def generate_verification_token(self) -> str:
         """Generate a secure verification token"""
         return str(uuid.uuid4())
     
-    async def create_user(self, user_data) -> UserResponse:
+    async def create_user(self, user_data, background_tasks: Optional[BackgroundTasks] = None) -> UserResponse:
         """Create a new user in the database with email verification"""
         # Convert dict to UserCreate if needed
         if isinstance(user_data, dict):
             user_data = UserCreate(**user_data)
         
-        # Check if user already exists
-        existing_user = await self.db.fetchrow(
-            "SELECT id FROM users WHERE email = $1 AND deleted_at IS NULL",
-            user_data.email
-        )
-        
-        if existing_user:
-            raise ValueError("User with this email already exists")
-        
         # Hash password
-        hashed_password = self.hash_password(user_data.password)
+        hashed_password = await self.hash_password(user_data.password)
         
         # Generate email verification token
         verification_token = self.generate_verification_token()
-        verification_expires = datetime.utcnow() + timedelta(hours=24)  # 24 hours expiry
         
         # Create user with pending verification status
         user_id = uuid.uuid4()
@@ -59,7 +82,8 @@ class UserService:
             id, full_name, email, phone, user_type, language_preference, 
             currency_preference, password_hash, profile_status, email_verified,
             email_verification_token, email_verification_expires
-        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12)
+        ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, CURRENT_TIMESTAMP + INTERVAL '24 hours')
+        ON CONFLICT (email) DO NOTHING
         RETURNING *
         """
         
@@ -75,12 +99,16 @@ class UserService:
             hashed_password,
             "pending_verification",  # Set to pending verification
             False,                   # Email not verified yet
-            verification_token,
-            verification_expires
+            verification_token       # Expires in 24 hours
         )
         
-        # Send verification email
-        await self.email_service.send_verification_email(
+        # Nothing inserted means the email is already taken
+        if result is None:
+            raise ValueError("User with this email already exists")
+        
+        # Send verification email (after the response when called from an endpoint)
+        await self._send_verification_email(
+            background_tasks,
             user_data.email, 
             user_data.full_name, 
             verification_token
@@ -90,9 +118,24 @@ class UserService:
     
     async def verify_email(self, token: str) -> bool:
         """Verify user email with token"""
-        # Find user with this verification token
+        # Verify and activate the user in one statement when the token is valid
+        update_query = """
+        UPDATE users 
+        SET email_verified = TRUE, 
+            profile_status = 'active',
+            email_verification_token = NULL,
+            email_verification_expires = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE email_verification_token = $1 AND deleted_at IS NULL
+          AND email_verified = FALSE AND email_verification_expires >= CURRENT_TIMESTAMP
+        RETURNING id
+        """
+        if await self.db.fetchval(update_query, token) is not None:
+            return True
+        
+        # Work out why the token was rejected
         query = """
-        SELECT id, email_verification_expires, email_verified 
+        SELECT email_verification_expires, email_verified 
         FROM users 
         WHERE email_verification_token = $1 AND deleted_at IS NULL
         """
@@ -105,28 +148,12 @@ class UserService:
         if user["email_verified"]:
             raise ValueError("Email is already verified")
         
-        # Check if token is expired
-        if user["email_verification_expires"] < datetime.utcnow():
-            raise ValueError("Verification token has expired")
-        
-        # Update user to verified status
-        update_query = """
-        UPDATE users 
-        SET email_verified = TRUE, 
-            profile_status = 'active',
-            email_verification_token = NULL,
-            email_verification_expires = NULL,
-            updated_at = $1
-        WHERE id = $2
-        """
-        await self.db.execute(update_query, datetime.utcnow(), user["id"])
-        
-        return True
+        raise ValueError("Verification token has expired")
     
-    async def resend_verification_email(self, email: str) -> bool:
+    async def resend_verification_email(self, email: str, background_tasks: Optional[BackgroundTasks] = None) -> bool:
         """Resend verification email for existing user"""
         # Find user by email
-        user = await self.get_user_by_email(email)
+        user = await self._get_auth_row(email)
         
         if not user:
             raise ValueError("User not found")
@@ -136,20 +163,20 @@ class UserService:
         
         # Generate new verification token
         verification_token = self.generate_verification_token()
-        verification_expires = datetime.utcnow() + timedelta(hours=24)
         
         # Update user with new token
         update_query = """
         UPDATE users 
         SET email_verification_token = $1,
-            email_verification_expires = $2,
-            updated_at = $3
-        WHERE id = $4
+            email_verification_expires = CURRENT_TIMESTAMP + INTERVAL '24 hours',
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = $2
         """
-        await self.db.execute(update_query, verification_token, verification_expires, datetime.utcnow(), user["id"])
+        await self.db.execute(update_query, verification_token, user["id"])
         
-        # Send verification email
-        await self.email_service.send_verification_email(
+        # Send verification email (after the response when called from an endpoint)
+        await self._send_verification_email(
+            background_tasks,
             user["email"], 
             user["full_name"], 
             verification_token
@@ -157,6 +184,13 @@ class UserService:
         
         return True
     
+    async def _send_verification_email(self, background_tasks: Optional[BackgroundTasks], email: str, full_name: str, verification_token: str) -> None:
+        """Send a verification email now, or schedule it to run after the response"""
+        if background_tasks is None:
+            await self.email_service.send_verification_email(email, full_name, verification_token)
+        else:
+            background_tasks.add_task(self.email_service.send_verification_email, email, full_name, verification_token)
+    
     async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """Get user by email"""
         query = """
@@ -166,6 +200,11 @@ class UserService:
         result = await self.db.fetchrow(query, email)
         return dict(result) if result else None
     
+    async def _get_auth_row(self, email: str) -> Optional[Record]:
+        """Get the columns needed for authentication of a user by email"""
+        # Callers only read fields, so the asyncpg Record is returned as-is
+        return await self.db.fetchrow(GET_AUTH_USER_QUERY, email)
+    
     async def get_user_by_id(self, user_id: uuid.UUID) -> Optional[Dict[str, Any]]:
         """Get user by ID"""
         query = """
@@ -175,30 +214,30 @@ class UserService:
         result = await self.db.fetchrow(query, user_id)
         return dict(result) if result else None
     
-    async def authenticate_user(self, email: str, password: str) -> Optional[Dict[str, Any]]:
+    async def authenticate_user(self, email: str, password: str) -> Optional[Record]:
         """Authenticate user with email and password"""
-        print(f"DEBUG: authenticate_user called for email: {email}")
-        user = await self.get_user_by_email(email)
+        logger.debug("authenticate_user email=%s", email)
+        user = await self._get_auth_row(email)
         
         if not user:
-            print(f"DEBUG: User not found for email: {email}")
+            logger.debug("authenticate_user user not found email=%s", email)
             return None
         
-        print(f"DEBUG: User found, password_hash exists: {user.get('password_hash') is not None}")
-        print(f"DEBUG: User profile_status: {user.get('profile_status')}")
-        print(f"DEBUG: User email_verified: {user.get('email_verified')}")
+        logger.debug(
+            "authenticate_user found user_id=%s profile_status=%s email_verified=%s",
+            user["id"], user["profile_status"], user["email_verified"]
+        )
         
         try:
-            if not self.verify_password(password, user["password_hash"]):
-                print(f"DEBUG: Password verification failed")
+            if not await self.verify_password(password, user["password_hash"]):
+                logger.debug("authenticate_user password mismatch user_id=%s", user["id"])
                 return None
-            print(f"DEBUG: Password verification succeeded")
-        except Exception as e:
-            print(f"Password verification exception: {e}")
+        except Exception:
+            logger.warning("Password verification failed with an exception user_id=%s", user["id"], exc_info=True)
             return None
         
         # Check if account is locked
-        if user["account_locked_until"] and user["account_locked_until"] > datetime.utcnow():
+        if user["account_locked"]:
             raise ValueError("Account is temporarily locked")
         
         # Check if email is verified
@@ -215,50 +254,29 @@ class UserService:
         """Update user's last login timestamp"""
         query = """
         UPDATE users 
-        SET last_login = $1, updated_at = $1
-        WHERE id = $2
+        SET last_login = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = $1
         """
-        await self.db.execute(query, datetime.utcnow(), user_id)
+        await self.db.execute(query, user_id)
     
     async def update_user(self, user_id: uuid.UUID, user_data: UserUpdate) -> Optional[UserResponse]:
         """Update user information"""
-        # Build dynamic update query
+        # Build dynamic update query from the fields the client sent
         update_fields = []
         values = []
         param_count = 1
         
-        if user_data.full_name is not None:
-            update_fields.append(f"full_name = ${param_count}")
-            values.append(user_data.full_name)
-            param_count += 1
-        
-        if user_data.phone is not None:
-            update_fields.append(f"phone = ${param_count}")
-            values.append(user_data.phone)
-            param_count += 1
-        
-        if user_data.language_preference is not None:
-            update_fields.append(f"language_preference = ${param_count}")
-            values.append(user_data.language_preference)
-            param_count += 1
-        
-        if user_data.currency_preference is not None:
-            update_fields.append(f"currency_preference = ${param_count}")
-            values.append(user_data.currency_preference)
-            param_count += 1
-        
-        if user_data.profile_picture is not None:
-            update_fields.append(f"profile_picture = ${param_count}")
-            values.append(user_data.profile_picture)
-            param_count += 1
+        for field, value in user_data.model_dump(exclude_unset=True).items():
+            if field in UPDATABLE_USER_COLUMNS and value is not None:
+                update_fields.append(f"{field} = ${param_count}")
+                values.append(value)
+                param_count += 1
         
         if not update_fields:
             return None
         
-        # Add updated_at and user_id
-        update_fields.append(f"updated_at = ${param_count}")
-        values.append(datetime.utcnow())
-        param_count += 1
+        # Set updated_at server-side
+        update_fields.append("updated_at = CURRENT_TIMESTAMP")
         
         values.append(user_id)
         
@@ -274,52 +292,37 @@ class UserService:
     
     async def increment_failed_login_attempts(self, user_id: uuid.UUID) -> None:
         """Increment failed login attempts and lock account if needed"""
-        # Get current failed attempts
-        user = await self.get_user_by_id(user_id)
-        if not user:
-            return
-        
-        failed_attempts = user["failed_login_attempts"] + 1
-        
-        if failed_attempts >= 5:
-            # Lock account for 15 minutes
-            lock_until = datetime.utcnow().replace(second=0, microsecond=0)
-            lock_until = lock_until.replace(minute=lock_until.minute + 15)
-            
-            query = """
-            UPDATE users 
-            SET failed_login_attempts = $1, account_locked_until = $2
-            WHERE id = $3
-            """
-            await self.db.execute(query, failed_attempts, lock_until, user_id)
-        else:
-            query = """
-            UPDATE users 
-            SET failed_login_attempts = $1
-            WHERE id = $2
-            """
-            await self.db.execute(query, failed_attempts, user_id)
+        # Increment and lock the account for 15 minutes on the fifth failure, in one statement
+        query = """
+        UPDATE users 
+        SET failed_login_attempts = failed_login_attempts + 1,
+            account_locked_until = CASE WHEN failed_login_attempts + 1 >= 5
+                                        THEN date_trunc('minute', CURRENT_TIMESTAMP) + INTERVAL '15 minutes'
+                                        ELSE account_locked_until END
+        WHERE id = $1 AND deleted_at IS NULL
+        """
+        await self.db.execute(query, user_id)
     
-    async def update_user_profile(self, user_id: uuid.UUID, update_data: UserUpdate) -> Optional[Dict[str, Any]]:
-        """Update user profile"""
+    async def update_user_profile(self, user_id: uuid.UUID, update_data: UserUpdate, current_user: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Update user profile, returning current_user unchanged (if given) when nothing changes"""
         # Build update query dynamically
         update_fields = []
         values = []
         param_count = 1
         
         for field, value in update_data.model_dump(exclude_unset=True).items():
-            if value is not None:
+            if field in UPDATABLE_USER_COLUMNS and value is not None:
                 update_fields.append(f"{field} = ${param_count}")
                 values.append(value)
                 param_count += 1
         
         if not update_fields:
+            if current_user is not None:
+                return current_user
             return await self.get_user_by_id(user_id)
         
-        # Add updated_at timestamp with correct parameter number
-        update_fields.append(f"updated_at = ${param_count}")
-        values.append(datetime.utcnow())
-        param_count += 1
+        # Set updated_at server-side
+        update_fields.append("updated_at = CURRENT_TIMESTAMP")
         
         query = f"""
         UPDATE users 
@@ -337,28 +340,21 @@ class UserService:
         """Delete a user (soft delete)"""
         query = """
         UPDATE users 
-        SET deleted_at = $1 
-        WHERE id = $2 AND deleted_at IS NULL
+        SET deleted_at = CURRENT_TIMESTAMP
+        WHERE id = $1 AND deleted_at IS NULL
         """
-        result = await self.db.execute(query, datetime.utcnow(), user_id)
+        result = await self.db.execute(query, user_id)
         return result == "DELETE 1"
     
     async def store_refresh_token(self, user_id: uuid.UUID, refresh_token: str) -> None:
         """Store refresh token hash in user_sessions table"""
-        import hashlib
-        from datetime import datetime, timedelta
-        from app.core.config import settings
-        
         # Hash the refresh token
-        token_hash = hashlib.sha256(refresh_token.encode()).hexdigest()
-        
-        # Calculate expiration time
-        expires_at = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
+        token_hash = hash_refresh_token(refresh_token)
         
-        # Store in user_sessions table
+        # Store in user_sessions table, expiring with the refresh token
         query = """
         INSERT INTO user_sessions (user_id, refresh_token_hash, expires_at, is_active)
-        VALUES ($1, $2, $3, TRUE)
+        VALUES ($1, $2, CURRENT_TIMESTAMP + make_interval(days => $3), TRUE)
         """
         
-        await self.db.execute(query, user_id, token_hash, expires_at) 
\ No newline at end of file
+        await self.db.execute(query, user_id, token_hash, settings.REFRESH_TOKEN_EXPIRE_DAYS) 
\ No newline at end of file
@@ -1,11 +1,38 @@
 import jwt
-from datetime import datetime, timedelta
+import secrets
+import time
+from datetime import timedelta
 from typing import Optional, Dict, Any
 from uuid import UUID
 from fastapi import HTTPException, status
 from app.core.config import settings
 
 
+# Signing key encoded once instead of on every encode/decode
+_SIGNING_KEY = settings.JWT_SECRET_KEY.encode()
+
+# Longer tokens are rejected without decoding them
+MAX_TOKEN_LENGTH = 8192
+
+# Token lifetimes in seconds, added to the current POSIX time for "exp"
+ACCESS_TOKEN_LIFETIME = int(timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES).total_seconds())
+REFRESH_TOKEN_LIFETIME = int(timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS).total_seconds())
+MFA_SESSION_TOKEN_LIFETIME = int(timedelta(days=settings.MFA_SESSION_DAYS).total_seconds())
+TEMP_TOKEN_LIFETIME = 5 * 60
+
+
+def _expires_at(lifetime: int, expires_delta: Optional[timedelta] = None) -> int:
+    """Compute an "exp" NumericDate from now"""
+    if expires_delta:
+        return int(time.time() + expires_delta.total_seconds())
+    return int(time.time()) + lifetime
+
+
+def _encode_hs256(payload: Dict[str, Any]) -> str:
+    """Encode and sign an HS256 JWT"""
+    return jwt.encode(payload, _SIGNING_KEY, algorithm="HS256")
+
+
 class JWTManager:
     """JWT token management utilities"""
     
@@ -15,16 +42,8 @@ class JWTManager:
         expires_delta: Optional[timedelta] = None
     ) -> str:
         """Create a new access token"""
-        to_encode = data.copy()
-        
-        if expires_delta:
-            expire = datetime.utcnow() + expires_delta
-        else:
-            expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-        
-        to_encode.update({"exp": expire, "type": "access"})
-        encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm="HS256")
-        return encoded_jwt
+        to_encode = {**data, "exp": _expires_at(ACCESS_TOKEN_LIFETIME, expires_delta), "type": "access"}
+        return _encode_hs256(to_encode)
     
     @staticmethod
     def create_refresh_token(
@@ -32,22 +51,14 @@ class JWTManager:
         expires_delta: Optional[timedelta] = None
     ) -> str:
         """Create a new refresh token"""
-        to_encode = data.copy()
-        
-        if expires_delta:
-            expire = datetime.utcnow() + expires_delta
-        else:
-            expire = datetime.utcnow() + timedelta(days=settings.REFRESH_TOKEN_EXPIRE_DAYS)
-        
         # Add a unique identifier to make each refresh token unique
-        import uuid
-        to_encode.update({
-            "exp": expire, 
+        to_encode = {
+            **data,
+            "exp": _expires_at(REFRESH_TOKEN_LIFETIME, expires_delta),
             "type": "refresh",
-            "jti": str(uuid.uuid4())  # JWT ID - unique identifier
-        })
-        encoded_jwt = jwt.encode(to_encode, settings.JWT_SECRET_KEY, algorithm="HS256")
-        return encoded_jwt
+            "jti": secrets.token_urlsafe(16)  # JWT ID - unique identifier
+        }
+        return _encode_hs256(to_encode)
     
     @staticmethod
     def create_mfa_session_token(user_id: UUID, email: str) -> str:
@@ -59,10 +70,9 @@ class JWTManager:
         }
         
         # MFA session token expires in MFA_SESSION_DAYS
-        expire = datetime.utcnow() + timedelta(days=settings.MFA_SESSION_DAYS)
-        user_data.update({"exp": expire, "type": "mfa_session"})
+        user_data.update({"exp": _expires_at(MFA_SESSION_TOKEN_LIFETIME), "type": "mfa_session"})
         
-        encoded_jwt = jwt.encode(user_data, settings.JWT_SECRET_KEY, algorithm="HS256")
+        encoded_jwt = _encode_hs256(user_data)
         return encoded_jwt
     
     @staticmethod
@@ -76,26 +86,23 @@ class JWTManager:
         }
         
         # Temporary token expires in 5 minutes
-        expire = datetime.utcnow() + timedelta(minutes=5)
-        user_data.update({"exp": expire, "type": "temp"})
+        user_data.update({"exp": _expires_at(TEMP_TOKEN_LIFETIME), "type": "temp"})
         
-        encoded_jwt = jwt.encode(user_data, settings.JWT_SECRET_KEY, algorithm="HS256")
+        encoded_jwt = _encode_hs256(user_data)
         return encoded_jwt
     
     @staticmethod
     def verify_token(token: str, token_type: str = "access") -> Dict[str, Any]:
         """Verify and decode a JWT token"""
+        # Reject oversized or obviously malformed tokens before any decoding or crypto
+        if len(token) > MAX_TOKEN_LENGTH or token.count(".") != 2:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token"
+            )
+        
         try:
-            payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256"])
-            
-            # Check token type
-            if payload.get("type") != token_type:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid token type"
-                )
-            
-            return payload
+            payload = jwt.decode(token, _SIGNING_KEY, algorithms=["HS256"])
         except jwt.ExpiredSignatureError:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -106,6 +113,15 @@ class JWTManager:
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid token"
             )
+        
+        # Check token type
+        if payload.get("type") != token_type:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid token type"
+            )
+        
+        return payload
     
     @staticmethod
     def create_user_tokens(user_id: UUID, email: str) -> Dict[str, Any]:
@@ -122,5 +138,5 @@ class JWTManager:
             "access_token": access_token,
             "refresh_token": refresh_token,
             "token_type": "bearer",
-            "expires_in": settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60  # seconds
+            "expires_in": ACCESS_TOKEN_LIFETIME  # seconds
         } 
\ No newline at end of file
@@ -1,13 +1,68 @@
 import pyotp
 import qrcode
+from qrcode.image.svg import SvgPathFillImage
 import base64
+import functools
+import hashlib
+import hmac
+import os
 import secrets
+import time
 from io import BytesIO
-from typing import List
+from typing import List, Tuple
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from app.core.config import settings
 
 
+# Leading byte of stored ciphertexts: Fernet tokens start with 0x80, AES-GCM ones with this
+AESGCM_VERSION = b"\x01"
+FERNET_VERSION = 0x80
+
+# Backup codes are stored back-to-back in fixed-width slots of this many bytes
+BACKUP_CODE_LENGTH = 8
+
+
+@functools.lru_cache(maxsize=None)
+def _get_ciphers(key: str) -> Tuple[Fernet, AESGCM]:
+    """Build the Fernet and AES-GCM ciphers for a key once per process"""
+    key_bytes = key.encode()
+    # Fernet is kept to decrypt values written before the switch to AES-GCM
+    fernet = Fernet(key_bytes)
+    # Derive a separate AES-256-GCM key rather than reusing the Fernet key material
+    aead_key = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=None,
+        info=b"personal-finance-manager totp aes-gcm"
+    ).derive(base64.urlsafe_b64decode(key_bytes))
+    return fernet, AESGCM(aead_key)
+
+
+# RFC 6238 parameters used by pyotp's defaults (and authenticator apps)
+TOTP_INTERVAL = 30
+TOTP_DIGITS = 6
+
+# Clock used for TOTP steps; a module-level name so tests can pin it without touching time.time
+_now = time.time
+
+
+def _decode_secret(secret: str) -> bytes:
+    """Decode a base32 TOTP secret into its HMAC key"""
+    padded = secret + "=" * (-len(secret) % 8)
+    return base64.b32decode(padded, casefold=True)
+
+
+def _hotp(key: bytes, counter: int) -> bytes:
+    """Compute the RFC 4226 HOTP code for a counter"""
+    digest = hmac.new(key, counter.to_bytes(8, "big"), hashlib.sha1).digest()
+    offset = digest[-1] & 0x0F
+    code = (int.from_bytes(digest[offset:offset + 4], "big") & 0x7FFFFFFF) % 10 ** TOTP_DIGITS
+    return f"{code:0{TOTP_DIGITS}d}".encode()
+
+
 class TOTPManager:
     """TOTP (Time-based One-Time Password) management utilities"""
     
@@ -19,12 +74,8 @@ class TOTPManager:
     @staticmethod
     def generate_backup_codes(count: int = 10) -> List[str]:
         """Generate backup codes for account recovery"""
-        codes = []
-        for _ in range(count):
-            # Generate 8-digit backup codes
-            code = ''.join(secrets.choice('0123456789') for _ in range(8))
-            codes.append(code)
-        return codes
+        # Generate 8-digit backup codes, one random draw per code
+        return [f"{secrets.randbelow(10 ** BACKUP_CODE_LENGTH):0{BACKUP_CODE_LENGTH}d}" for _ in range(count)]
     
     @staticmethod
     def generate_qr_code(secret: str, email: str, app_name: str = "Personal Finance Manager") -> str:
@@ -38,9 +89,12 @@ class TOTPManager:
     
     @staticmethod
     def generate_qr_code_image(secret: str, email: str, app_name: str = "Personal Finance Manager") -> str:
-        """Generate QR code image as base64 string"""
-        qr_url = TOTPManager.generate_qr_code(secret, email, app_name)
-        
+        """Generate QR code image as a base64 SVG data URI"""
+        return TOTPManager.render_qr_code_image(TOTPManager.generate_qr_code(secret, email, app_name))
+    
+    @staticmethod
+    def render_qr_code_image(qr_url: str) -> str:
+        """Render an already-built provisioning URI as a base64 SVG data URI"""
         # Create QR code
         qr = qrcode.QRCode(
             version=1,
@@ -51,21 +105,31 @@ class TOTPManager:
         qr.add_data(qr_url)
         qr.make(fit=True)
         
-        # Create image
-        img = qr.make_image(fill_color="black", back_color="white")
+        # Create image as a single SVG path on a white background (no PIL rasterizing or PNG encoding)
+        img = qr.make_image(image_factory=SvgPathFillImage)
         
         # Convert to base64
         buffer = BytesIO()
-        img.save(buffer, format='PNG')
+        img.save(buffer)
         img_str = base64.b64encode(buffer.getvalue()).decode()
         
-        return f"data:image/png;base64,{img_str}"
+        return f"data:image/svg+xml;base64,{img_str}"
     
     @staticmethod
     def verify_code(secret: str, code: str, window: int = 1) -> bool:
         """Verify a TOTP code"""
-        totp = pyotp.TOTP(secret)
-        return totp.verify(code, valid_window=window)
+        if not code:
+            return False
+        
+        target = code.encode()
+        # Decoded per call so plaintext secrets are not kept around in a cache
+        key = _decode_secret(secret)
+        counter = int(_now()) // TOTP_INTERVAL
+        # Check every step in the window with a constant-time compare
+        matched = False
+        for step in range(counter - window, counter + window + 1):
+            matched |= hmac.compare_digest(_hotp(key, step), target)
+        return matched
     
     @staticmethod
     def get_current_code(secret: str) -> str:
@@ -78,26 +142,41 @@ class TOTPEncryption:
     """Encryption utilities for TOTP secrets and backup codes"""
     
     def __init__(self, key: str = None):
-        if key:
-            self.fernet = Fernet(key.encode())
-        else:
-            # Use the key from settings for consistency
-            self.fernet = Fernet(settings.FERNET_KEY.encode())
+        # Use the key from settings for consistency; ciphers are shared per key
+        self.fernet, self.aesgcm = _get_ciphers(key or settings.FERNET_KEY)
+    
+    def encrypt_bytes(self, data: bytes) -> str:
+        """Encrypt bytes with AES-256-GCM"""
+        nonce = os.urandom(12)
+        ciphertext = self.aesgcm.encrypt(nonce, data, None)
+        return base64.urlsafe_b64encode(AESGCM_VERSION + nonce + ciphertext).decode()
+    
+    def decrypt_bytes(self, encrypted_data: str) -> bytes:
+        """Decrypt to bytes (AES-GCM, or Fernet for legacy values)"""
+        raw = base64.urlsafe_b64decode(encrypted_data.encode())
+        if raw[:1] == AESGCM_VERSION:
+            return self.aesgcm.decrypt(raw[1:13], raw[13:], None)
+        if raw[:1] == bytes([FERNET_VERSION]):
+            return self.fernet.decrypt(encrypted_data.encode())
+        raise ValueError("Unknown encrypted data format")
     
     def encrypt(self, data: str) -> str:
         """Encrypt data"""
-        return self.fernet.encrypt(data.encode()).decode()
+        return self.encrypt_bytes(data.encode())
     
     def decrypt(self, encrypted_data: str) -> str:
         """Decrypt data"""
-        return self.fernet.decrypt(encrypted_data.encode()).decode()
+        return self.decrypt_bytes(encrypted_data).decode()
     
     def encrypt_backup_codes(self, codes: List[str]) -> str:
-        """Encrypt backup codes"""
-        codes_str = ','.join(codes)
-        return self.encrypt(codes_str)
+        """Encrypt backup codes as fixed-width slots"""
+        blob = b''.join(code.encode().ljust(BACKUP_CODE_LENGTH) for code in codes)
+        return self.encrypt_bytes(blob)
     
     def decrypt_backup_codes(self, encrypted_codes: str) -> List[str]:
         """Decrypt backup codes"""
-        codes_str = self.decrypt(encrypted_codes)
-        return codes_str.split(',') 
\ No newline at end of file
+        blob = self.decrypt_bytes(encrypted_codes)
+        if b',' in blob:
+            # Comma-separated layout written before fixed-width slots
+            return blob.decode().split(',')
+        return [blob[i:i + BACKUP_CODE_LENGTH].rstrip().decode() for i in range(0, len(blob), BACKUP_CODE_LENGTH)] 
\ No newline at end of file
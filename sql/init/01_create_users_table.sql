@@ -30,6 +30,7 @@ CREATE TABLE users (
     totp_enabled BOOLEAN DEFAULT FALSE,
     email_mfa_enabled BOOLEAN DEFAULT FALSE,
     backup_codes_encrypted TEXT,
+    backup_codes_remaining INTEGER DEFAULT 0,
     
     -- Security fields
     failed_login_attempts INTEGER DEFAULT 0,
@@ -47,6 +48,7 @@ CREATE TABLE users (
 CREATE INDEX idx_users_email ON users(email);
 CREATE INDEX idx_users_google_id ON users(google_id);
 CREATE INDEX idx_users_firebase_uid ON users(firebase_uid);
+CREATE INDEX idx_users_email_verification_token ON users(email_verification_token) WHERE email_verification_token IS NOT NULL;
 CREATE INDEX idx_users_user_type ON users(user_type);
 CREATE INDEX idx_users_profile_status ON users(profile_status);
 CREATE INDEX idx_users_created_at ON users(created_at);
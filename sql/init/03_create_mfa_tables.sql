@@ -23,6 +23,7 @@ CREATE TABLE mfa_attempts (
 CREATE INDEX idx_email_mfa_codes_user_id ON email_mfa_codes(user_id);
 CREATE INDEX idx_email_mfa_codes_expires_at ON email_mfa_codes(expires_at);
 CREATE INDEX idx_email_mfa_codes_used ON email_mfa_codes(used);
+CREATE INDEX idx_email_mfa_codes_user_code_hash ON email_mfa_codes(user_id, code_hash) WHERE used = FALSE;
 
 CREATE INDEX idx_mfa_attempts_user_id_created ON mfa_attempts(user_id, created_at);
 CREATE INDEX idx_mfa_attempts_method_success ON mfa_attempts(method, success);
@@ -1,65 +1,190 @@
+import os
+
+# Minimum bcrypt cost for the test session; must be set before the app reads settings
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
 import pytest
 import pytest_asyncio
 import asyncio
-from httpx import AsyncClient
+import functools
+import hashlib
+import itertools
+from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit
+import asyncpg
+from asgi_lifespan import LifespanManager
+from httpx import ASGITransport, AsyncClient, Headers
 from app.main import app
+from app.api.deps import get_database
+from app.core.config import settings
 from app.core.database import Database, get_db
-from app.services.user_service import UserService
+from app.services.user_service import UserService, pwd_context
 from app.services.mfa_service import MFAService
 from app.utils.jwt import JWTManager
+from app.utils.totp import TOTPManager
 import uuid
 
 @pytest_asyncio.fixture(scope="session")
 def event_loop():
     """Create an instance of the default event loop for the test session."""
-    loop = asyncio.get_event_loop_policy().new_event_loop()
+    # uvloop comes with uvicorn[standard] everywhere but Windows
+    try:
+        import uvloop
+    except ImportError:
+        loop = asyncio.get_event_loop_policy().new_event_loop()
+    else:
+        loop = uvloop.new_event_loop()
     yield loop
     loop.close()
 
+# Schema scripts applied to the template database, in order
+SQL_INIT_DIR = Path(__file__).resolve().parent.parent / "sql" / "init"
+
+
+def _schema_scripts():
+    """Read the schema scripts the template database is built from"""
+    return [path.read_text(encoding="utf-8") for path in sorted(SQL_INIT_DIR.glob("*.sql"))]
+
+
+def _database_url(name: str) -> str:
+    """Point the configured DATABASE_URL at another database on the same server"""
+    return urlunsplit(urlsplit(settings.DATABASE_URL)._replace(path=f"/{name}"))
+
+
+async def _create_worker_database(worker_id: str) -> str:
+    """Clone this worker's database from a template built once from sql/init"""
+    scripts = _schema_scripts()
+    # The template name changes with the schema, so a stale template is never reused
+    template = f"pfm_template_{hashlib.sha256(''.join(scripts).encode()).hexdigest()[:12]}"
+    name = f"test_{worker_id}"
+    
+    admin = await asyncpg.connect(_database_url("postgres"))
+    try:
+        # Workers start together; only the first one builds the template
+        await admin.execute("SELECT pg_advisory_lock(hashtext($1))", template)
+        try:
+            if not await admin.fetchval("SELECT 1 FROM pg_database WHERE datname = $1", template):
+                await admin.execute(f'CREATE DATABASE "{template}"')
+                conn = await asyncpg.connect(_database_url(template))
+                try:
+                    for script in scripts:
+                        await conn.execute(script)
+                finally:
+                    await conn.close()
+        finally:
+            await admin.execute("SELECT pg_advisory_unlock(hashtext($1))", template)
+        
+        await admin.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        await admin.execute(f'CREATE DATABASE "{name}" TEMPLATE "{template}"')
+    finally:
+        await admin.close()
+    return name
+
+
+class TransactionalDatabase(Database):
+    """Database bound to one connection, so a test's writes can be rolled back"""
+    
+    def __init__(self, connection: asyncpg.Connection):
+        super().__init__()
+        self.connection = connection
+        # A connection runs one query at a time; gathered service calls take turns
+        self._lock = asyncio.Lock()
+    
+    async def _run(self, method: str, query: str, *args):
+        """Run one statement inside a savepoint, like an autocommitted pool query"""
+        async with self._lock:
+            # A failing statement only rolls back its savepoint, not the whole test
+            async with self.connection.transaction():
+                return await getattr(self.connection, method)(query, *args)
+    
+    async def execute(self, query: str, *args):
+        """Execute a query"""
+        return await self._run("execute", query, *args)
+    
+    async def fetch(self, query: str, *args):
+        """Fetch multiple rows"""
+        return await self._run("fetch", query, *args)
+    
+    async def fetchrow(self, query: str, *args):
+        """Fetch a single row"""
+        return await self._run("fetchrow", query, *args)
+    
+    async def fetchval(self, query: str, *args):
+        """Fetch a single value"""
+        return await self._run("fetchval", query, *args)
+
+
 @pytest_asyncio.fixture(scope="session")
 async def test_db():
-    """Create test database instance"""
-    database = Database()
+    """Create this worker's test database from the schema template"""
+    # Set by pytest-xdist in each worker; a plain run without xdist uses one "master" database
+    name = await _create_worker_database(os.environ.get("PYTEST_XDIST_WORKER", "master"))
+    # Tests use one connection at a time, so a small pool keeps its statement caches warm
+    database = Database(_database_url(name), min_size=2, max_size=8)
     await database.connect()
     yield database
     await database.disconnect()
 
 @pytest_asyncio.fixture
 async def db_session(test_db):
-    """Create a fresh database session for each test."""
-    # For raw SQL, we just return the database instance
-    yield test_db
+    """Run each test inside a transaction that is rolled back afterwards."""
+    pool = await test_db.get_pool()
+    async with pool.acquire() as connection:
+        transaction = connection.transaction()
+        await transaction.start()
+        session = TransactionalDatabase(connection)
+        try:
+            yield session
+        finally:
+            await transaction.rollback()
 
-@pytest_asyncio.fixture
-async def client(db_session):
+@pytest_asyncio.fixture(scope="session")
+async def _asgi_client():
+    """One HTTP client bound to the app for the whole session"""
+    # ASGITransport does not send lifespan events, so run startup and shutdown once here
+    async with LifespanManager(app) as manager:
+        async with AsyncClient(transport=ASGITransport(app=manager.app), base_url="http://test") as ac:
+            yield ac
+
+@pytest.fixture
+def client(_asgi_client, db_session):
     """Create a test client with database dependency overridden."""
     async def override_get_db():
-        yield db_session
+        return db_session
     
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_database] = override_get_db
     
-    async with AsyncClient(app=app, base_url="http://test") as ac:
-        yield ac
+    yield _asgi_client
     
     app.dependency_overrides.clear()
+    # The client is shared, so nothing a response set may leak into the next test
+    _asgi_client.cookies.clear()
 
-@pytest_asyncio.fixture
-async def user_service(db_session):
+@pytest.fixture
+def user_service(db_session):
     """User service fixture"""
     return UserService(db_session)
 
-@pytest_asyncio.fixture
-async def mfa_service(db_session):
+@pytest.fixture
+def mfa_service(db_session):
     """MFA service fixture"""
     return MFAService(db_session)
 
+# Unique per test run; emails within a run come from a counter
+_RUN_ID = uuid.uuid4().hex[:8]
+_email_counter = itertools.count()
+
+
+def unique_email(prefix: str) -> str:
+    """Build an email address that is unique across tests and runs"""
+    return f"{prefix}_{_RUN_ID}_{next(_email_counter)}@example.com"
+
 @pytest.fixture
 def test_user_data():
     """Test user data fixture"""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
     return {
-        "email": f"test_{unique_id}@example.com",
+        "email": unique_email("test"),
         "password": "SecurePass123!",
         "full_name": "Test User",
         "phone": "+37412345678",
@@ -69,106 +194,104 @@ def test_user_data():
     }
 
 @pytest_asyncio.fixture
-async def test_user(db_session, user_service, test_user_data):
+async def test_user(db_session, test_user_data):
     """Create a test user and return user data"""
-    # Create test user
-    user = await user_service.create_user(test_user_data)
-    
-    # Convert UserResponse to dict for database operations
-    user_dict = user.model_dump()
-    
-    # Activate the user (set profile_status to active and email_verified to true)
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_dict["id"]
+    # Insert the user already active and verified in one round trip
+    row = await db_session.fetchrow(
+        """
+        INSERT INTO users (
+            full_name, email, phone, user_type, language_preference, currency_preference,
+            password_hash, profile_status, email_verified
+        )
+        VALUES ($1, $2, $3, $4, $5, $6, $7, 'active', TRUE)
+        RETURNING *
+        """,
+        test_user_data["full_name"], test_user_data["email"], test_user_data["phone"],
+        test_user_data["user_type"], test_user_data["language_preference"],
+        test_user_data["currency_preference"], _password_hash(test_user_data["password"])
     )
-    
-    # Get the updated user
-    updated_user = await user_service.get_user_by_id(user_dict["id"])
-    
-    yield updated_user
-    
-    # Cleanup - delete test user
-    await db_session.execute("DELETE FROM users WHERE id = $1", user_dict["id"])
+    return dict(row)
 
-@pytest_asyncio.fixture
-async def auth_headers(client, db_session):
-    """Create authenticated headers for testing."""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    
-    # Register a test user
-    user_data = {
-        "email": f"auth_test_{unique_id}@example.com",
-        "password": "Testpassword123!",
-        "full_name": "Test User",
-        "phone": "+37412345678",
-        "user_type": "individual",
-        "language_preference": "en",
-        "currency_preference": "USD"
-    }
-    
-    response = await client.post("/api/v1/auth/register", json=user_data)
-    assert response.status_code == 201
-    user_id = response.json()["id"]
-    # Verify the user
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_id
+# Password given to users inserted directly by the fixtures
+DEFAULT_TEST_PASSWORD = "Testpassword123!"
+
+@functools.lru_cache(maxsize=None)
+def _password_hash(password: str) -> str:
+    """Hash a test password once per session"""
+    return pwd_context.hash(password)
+
+async def _mint_user(db, email, user_type="individual", password=DEFAULT_TEST_PASSWORD):
+    """Insert an active, verified user directly and return its id and email"""
+    row = await db.fetchrow(
+        """
+        INSERT INTO users (
+            full_name, email, phone, user_type, language_preference, currency_preference,
+            password_hash, profile_status, email_verified
+        )
+        VALUES ('Test User', $1, '+37412345678', $2, 'en', 'USD', $3, 'active', TRUE)
+        RETURNING id, email
+        """,
+        email, user_type, _password_hash(password)
     )
-    
-    # Login to get token
-    login_data = {
-        "email": user_data["email"],
-        "password": user_data["password"]
-    }
-    
-    response = await client.post("/api/v1/auth/login", json=login_data)
-    assert response.status_code == 200
-    
-    token = response.json()["access_token"]
-    return {"Authorization": f"Bearer {token}"}
+    return dict(row)
 
 @pytest_asyncio.fixture
-async def admin_headers(client, db_session):
+async def verified_user_factory(db_session):
+    """Return a callable that inserts an active, verified user that can log in"""
+    async def factory(email, password=DEFAULT_TEST_PASSWORD, user_type="individual"):
+        return await _mint_user(db_session, email, user_type, password)
+    return factory
+
+@pytest_asyncio.fixture
+async def mint_user_tokens(db_session):
+    """Return a callable that issues login tokens for a user without the login endpoint"""
+    async def mint(user):
+        tokens = JWTManager.create_user_tokens(user["id"], user["email"])
+        # Record the session the same way login does, so /auth/refresh accepts the token
+        await UserService(db_session).store_refresh_token(user["id"], tokens["refresh_token"])
+        return tokens
+    return mint
+
+def _bearer_headers(user):
+    """Mint an access token in-process for a user"""
+    token = JWTManager.create_access_token({"sub": str(user["id"]), "email": user["email"]})
+    return Headers({"Authorization": f"Bearer {token}"})
+
+@pytest_asyncio.fixture(scope="session")
+async def _session_auth_user(test_db):
+    """Regular user committed once per session; each test's changes to it are rolled back"""
+    return await _mint_user(test_db, unique_email("auth_test"))
+
+@pytest_asyncio.fixture(scope="session")
+async def _session_admin_user(test_db):
+    """Admin (business) user committed once per session"""
+    return await _mint_user(test_db, unique_email("admin_test"), user_type="business")
+
+@pytest.fixture
+def verified_user(_session_auth_user, db_session):
+    """Active, verified session user with its login password; changes roll back per test"""
+    return {**_session_auth_user, "password": DEFAULT_TEST_PASSWORD}
+
+@pytest.fixture
+def auth_headers(_session_auth_user, db_session):
+    """Create authenticated headers for testing."""
+    # Tokens are signed in-process, so a fresh one per test never expires mid-session
+    return _bearer_headers(_session_auth_user)
+
+@pytest.fixture
+def admin_headers(_session_admin_user, db_session):
     """Create admin authenticated headers for testing."""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    
-    # Register an admin user
-    user_data = {
-        "email": f"admin_test_{unique_id}@example.com",
-        "password": "Adminpassword123!",
-        "full_name": "Admin User",
-        "phone": "+37412345678",
-        "user_type": "business",
-        "language_preference": "en",
-        "currency_preference": "USD"
-    }
-    
-    response = await client.post("/api/v1/auth/register", json=user_data)
-    assert response.status_code == 201
-    user_id = response.json()["id"]
-    # Verify the user
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_id
-    )
-    
-    # Login to get token
-    login_data = {
-        "email": user_data["email"],
-        "password": user_data["password"]
-    }
-    
-    response = await client.post("/api/v1/auth/login", json=login_data)
-    assert response.status_code == 200
-    
-    token = response.json()["access_token"]
-    return {"Authorization": f"Bearer {token}"}
+    return _bearer_headers(_session_admin_user)
 
 @pytest_asyncio.fixture
-async def temp_token(test_user):
+async def totp_setup(client, auth_headers):
+    """Start TOTP setup for the auth_headers user and return the setup response"""
+    response = await client.post("/api/v1/mfa/totp/setup", headers=auth_headers)
+    assert response.status_code == 200
+    return response.json()
+
+@pytest.fixture
+def temp_token(test_user):
     """Generate temporary token for MFA verification"""
     return JWTManager.create_temp_token(test_user["id"], test_user["email"], "totp")
 
@@ -185,31 +308,24 @@ def test_backup_codes():
 @pytest_asyncio.fixture
 async def test_user_with_totp(db_session, test_user, mfa_service, test_totp_secret):
     """Create a test user with TOTP enabled"""
-    # Setup TOTP for the user
-    totp_response = await mfa_service.setup_totp(test_user["id"], test_user["email"])
-    
-    # Verify and enable TOTP (we'll use the test secret directly)
+    # Write the enabled state directly; setup_totp would also render a QR code nobody reads
+    backup_codes = TOTPManager.generate_backup_codes()
     encrypted_secret = mfa_service.totp_encryption.encrypt(test_totp_secret)
-    encrypted_backup_codes = mfa_service.totp_encryption.encrypt_backup_codes(totp_response.backup_codes)
+    encrypted_backup_codes = mfa_service.totp_encryption.encrypt_backup_codes(backup_codes)
     
     await db_session.execute(
         """
         UPDATE users 
-        SET totp_secret_encrypted = $1, totp_enabled = TRUE, backup_codes_encrypted = $2
-        WHERE id = $3
+        SET totp_secret_encrypted = $1, totp_enabled = TRUE, backup_codes_encrypted = $2,
+            backup_codes_remaining = $3
+        WHERE id = $4
         """,
-        encrypted_secret, encrypted_backup_codes, test_user["id"]
+        encrypted_secret, encrypted_backup_codes, len(backup_codes), test_user["id"]
     )
     
     # Return user with backup codes for testing
     user_with_totp = test_user.copy()
-    user_with_totp["backup_codes"] = totp_response.backup_codes
+    user_with_totp["backup_codes"] = backup_codes
     user_with_totp["totp_secret"] = test_totp_secret
     
-    yield user_with_totp
-    
-    # Cleanup - disable TOTP
-    await db_session.execute(
-        "UPDATE users SET totp_secret_encrypted = NULL, totp_enabled = FALSE, backup_codes_encrypted = NULL WHERE id = $1",
-        test_user["id"]
-    ) 
\ No newline at end of file
+    return user_with_totp
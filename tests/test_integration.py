@@ -2,16 +2,17 @@ import pytest
 import pytest_asyncio
 from httpx import AsyncClient
 from app.main import app
+from app.utils.totp import TOTPManager
+from tests.conftest import unique_email
+
 
-@pytest.mark.asyncio
 async def test_complete_auth_flow(client, db_session):
     """Test complete authentication flow: register -> login -> get profile"""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
+    email = unique_email("integration")
     
     # Step 1: Register a new user
     user_data = {
-        "email": f"integration_{unique_id}@example.com",
+        "email": email,
         "password": "Integrationpass123!",
         "full_name": "Integration Test",
         "phone": "+37412345678",
@@ -34,7 +35,7 @@ async def test_complete_auth_flow(client, db_session):
     
     # Step 2: Login with the registered user
     login_data = {
-        "email": f"integration_{unique_id}@example.com",
+        "email": email,
         "password": "Integrationpass123!"
     }
     
@@ -54,35 +55,12 @@ async def test_complete_auth_flow(client, db_session):
     assert profile["email"] == user_data["email"]
     assert profile["full_name"] == user_data["full_name"]
 
-@pytest.mark.asyncio
-async def test_complete_mfa_flow(client, db_session):
-    """Test complete MFA flow: register -> login -> setup TOTP -> verify -> disable"""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    
-    # Step 1: Register and login
-    user_data = {
-        "email": f"mfa_{unique_id}@example.com",
-        "password": "Mfapass123!",
-        "full_name": "MFA Test",
-        "phone": "+37412345678",
-        "user_type": "individual",
-        "language_preference": "en",
-        "currency_preference": "USD"
-    }
-
-    response = await client.post("/api/v1/auth/register", json=user_data)
-    assert response.status_code == 201
-    user_id = response.json()["id"]
-    # Verify the user
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_id
-    )
-
+async def test_complete_mfa_flow(client, verified_user):
+    """Test complete MFA flow: login -> setup TOTP -> verify -> disable"""
+    # Step 1: Login
     login_data = {
-        "email": f"mfa_{unique_id}@example.com",
-        "password": "Mfapass123!"
+        "email": verified_user["email"],
+        "password": verified_user["password"]
     }
 
     response = await client.post("/api/v1/auth/login", json=login_data)
@@ -110,7 +88,6 @@ async def test_complete_mfa_flow(client, db_session):
     assert "backup_codes" in setup_data
 
     # Step 4: Verify and enable TOTP
-    from app.utils.totp import TOTPManager
     totp_code = TOTPManager.get_current_code(setup_data["secret"])
     
     verify_data = {"code": totp_code}
@@ -138,35 +115,12 @@ async def test_complete_mfa_flow(client, db_session):
     assert status["totp_enabled"] is False
     assert status["backup_codes_remaining"] == 0
 
-@pytest.mark.asyncio
-async def test_backup_codes_flow(client, db_session):
+async def test_backup_codes_flow(client, verified_user):
     """Test backup codes flow: setup TOTP -> use backup code -> verify remaining"""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    
-    # Step 1: Register, login, and setup TOTP
-    user_data = {
-        "email": f"backup_{unique_id}@example.com",
-        "password": "Backuppass123!",
-        "full_name": "Backup Test",
-        "phone": "+37412345678",
-        "user_type": "individual",
-        "language_preference": "en",
-        "currency_preference": "USD"
-    }
-
-    response = await client.post("/api/v1/auth/register", json=user_data)
-    assert response.status_code == 201
-    user_id = response.json()["id"]
-    # Verify the user
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_id
-    )
-
+    # Step 1: Login and setup TOTP
     login_data = {
-        "email": f"backup_{unique_id}@example.com",
-        "password": "Backuppass123!"
+        "email": verified_user["email"],
+        "password": verified_user["password"]
     }
 
     response = await client.post("/api/v1/auth/login", json=login_data)
@@ -183,7 +137,6 @@ async def test_backup_codes_flow(client, db_session):
     backup_codes = setup_data["backup_codes"]
 
     # Enable TOTP by verifying the setup code
-    from app.utils.totp import TOTPManager
     totp_code = TOTPManager.get_current_code(setup_data["secret"])
     verify_data = {"code": totp_code}
     response = await client.post("/api/v1/mfa/totp/verify", json=verify_data, headers=headers)
@@ -205,35 +158,12 @@ async def test_backup_codes_flow(client, db_session):
     response = await client.post("/api/v1/mfa/backup/verify", json=verify_data, headers=headers)
     assert response.status_code == 400
 
-@pytest.mark.asyncio
-async def test_mfa_login_flow(client, db_session):
-    """Test MFA login flow: register -> setup TOTP -> login with MFA"""
-    import uuid
-    unique_id = str(uuid.uuid4())[:8]
-    
-    # Step 1: Register and setup TOTP
-    user_data = {
-        "email": f"mfa_login_{unique_id}@example.com",
-        "password": "Mfaloginpass123!",
-        "full_name": "MFALogin Test",
-        "phone": "+37412345678",
-        "user_type": "individual",
-        "language_preference": "en",
-        "currency_preference": "USD"
-    }
-
-    response = await client.post("/api/v1/auth/register", json=user_data)
-    assert response.status_code == 201
-    user_id = response.json()["id"]
-    # Verify the user
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_id
-    )
-
+async def test_mfa_login_flow(client, verified_user):
+    """Test MFA login flow: login -> setup TOTP -> login with MFA"""
+    # Step 1: Login and setup TOTP
     login_data = {
-        "email": f"mfa_login_{unique_id}@example.com",
-        "password": "Mfaloginpass123!"
+        "email": verified_user["email"],
+        "password": verified_user["password"]
     }
 
     response = await client.post("/api/v1/auth/login", json=login_data)
@@ -249,7 +179,6 @@ async def test_mfa_login_flow(client, db_session):
     setup_data = response.json()
 
     # Enable TOTP
-    from app.utils.totp import TOTPManager
     totp_code = TOTPManager.get_current_code(setup_data["secret"])
     verify_data = {"code": totp_code}
     response = await client.post("/api/v1/mfa/totp/verify", json=verify_data, headers=headers)
@@ -265,7 +194,7 @@ async def test_mfa_login_flow(client, db_session):
 
     # Step 3: Verify MFA to get full access
     # Use the correct endpoint and request body for TOTP verification during login
-    mfa_verify_data = {"temp_token": login_response["temp_token"], "code": TOTPManager.get_current_code(setup_data["secret"]), "mfa_type": "totp"}
+    mfa_verify_data = {"temp_token": login_response["temp_token"], "code": totp_code, "mfa_type": "totp"}
     response = await client.post("/api/v1/auth/mfa/verify", json=mfa_verify_data)
     assert response.status_code == 200
     mfa_response = response.json()
@@ -277,22 +206,17 @@ async def test_mfa_login_flow(client, db_session):
     response = await client.get("/api/v1/users/profile", headers=full_headers)
     assert response.status_code == 200
 
-@pytest.mark.asyncio
-async def test_error_handling(client):
+@pytest.mark.parametrize("method,path,content,headers,expected_status", [
+    # 404 for non-existent endpoint
+    pytest.param("GET", "/api/v1/nonexistent", None, None, 404, id="not_found"),
+    # 422 for invalid JSON
+    pytest.param("POST", "/api/v1/auth/register", "invalid json", None, 422, id="invalid_json"),
+    # 401 for protected endpoint without auth
+    pytest.param("GET", "/api/v1/users/profile", None, None, 401, id="no_auth"),
+    # 401 for invalid token
+    pytest.param("GET", "/api/v1/users/profile", None, {"Authorization": "Bearer invalid_token"}, 401, id="invalid_token"),
+])
+async def test_error_handling(client, method, path, content, headers, expected_status):
     """Test error handling for various scenarios"""
-    # Test 404 for non-existent endpoint
-    response = await client.get("/api/v1/nonexistent")
-    assert response.status_code == 404
-    
-    # Test 422 for invalid JSON
-    response = await client.post("/api/v1/auth/register", data="invalid json")
-    assert response.status_code == 422
-    
-    # Test 401 for protected endpoint without auth
-    response = await client.get("/api/v1/users/profile")
-    assert response.status_code == 401
-    
-    # Test 401 for invalid token
-    headers = {"Authorization": "Bearer invalid_token"}
-    response = await client.get("/api/v1/users/profile", headers=headers)
-    assert response.status_code == 401 
\ No newline at end of file
+    response = await client.request(method, path, content=content, headers=headers)
+    assert response.status_code == expected_status
@@ -2,9 +2,9 @@ import pytest
 import pytest_asyncio
 from app.services.user_service import UserService
 from app.services.mfa_service import MFAService
+from app.utils.totp import TOTPManager
 # from app.core.security import verify_password  # Remove this import
 
-@pytest.mark.asyncio
 async def test_create_user(user_service, test_user_data):
     """Test user creation"""
     user = await user_service.create_user(test_user_data)
@@ -15,146 +15,69 @@ async def test_create_user(user_service, test_user_data):
     assert hasattr(user, 'id')
     assert not hasattr(user, 'password')
 
-@pytest.mark.asyncio
-async def test_get_user_by_email(user_service, test_user_data, db_session):
+async def test_get_user_by_email(user_service, test_user):
     """Test getting user by email"""
-    # Create user first
-    user = await user_service.create_user(test_user_data)
-    # Activate user
-    user_dict = user.model_dump()
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_dict["id"]
-    )
-    # Get user by email
-    retrieved_user = await user_service.get_user_by_email(test_user_data["email"])
-    assert retrieved_user["email"] == user.email
-    assert retrieved_user["id"] == user.id
+    retrieved_user = await user_service.get_user_by_email(test_user["email"])
+    assert retrieved_user["email"] == test_user["email"]
+    assert retrieved_user["id"] == test_user["id"]
 
-@pytest.mark.asyncio
 async def test_get_user_by_email_not_found(user_service):
     """Test getting user by email when not found"""
     user = await user_service.get_user_by_email("nonexistent@example.com")
     assert user is None
 
-@pytest.mark.asyncio
-async def test_authenticate_user(user_service, test_user_data, db_session):
-    """Test user authentication"""
-    # Create user first
-    user = await user_service.create_user(test_user_data)
-    # Activate user
-    user_dict = user.model_dump()
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_dict["id"]
-    )
-    
-    # Authenticate with correct password
-    authenticated_user = await user_service.authenticate_user(
-        test_user_data["email"], 
-        test_user_data["password"]
-    )
-    
-    assert authenticated_user["email"] == user.email
-    assert authenticated_user["id"] == user.id
-
-@pytest.mark.asyncio
-async def test_authenticate_user_wrong_password(user_service, test_user_data, db_session):
-    """Test user authentication with wrong password"""
-    # Create user first
-    user = await user_service.create_user(test_user_data)
-    # Activate user
-    user_dict = user.model_dump()
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        user_dict["id"]
-    )
-    
-    # Try to authenticate with wrong password
+@pytest.mark.parametrize("password,authenticates", [
+    pytest.param(None, True, id="correct_password"),
+    pytest.param("wrongpassword", False, id="wrong_password"),
+])
+async def test_authenticate_user(user_service, verified_user, password, authenticates):
+    """Test user authentication with the correct and a wrong password"""
     authenticated_user = await user_service.authenticate_user(
-        test_user_data["email"], 
-        "wrongpassword"
+        verified_user["email"], 
+        password or verified_user["password"]
     )
     
-    assert authenticated_user is None
+    if authenticates:
+        assert authenticated_user["email"] == verified_user["email"]
+        assert authenticated_user["id"] == verified_user["id"]
+    else:
+        assert authenticated_user is None
 
-@pytest.mark.asyncio
-async def test_totp_setup(mfa_service, test_user, db_session):
-    """Test TOTP setup"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
+async def test_totp_setup(mfa_service, test_user):
+    """Test TOTP setup and enabling it by verifying the setup code"""
     response = await mfa_service.setup_totp(test_user["id"], test_user["email"])
     
     assert response.secret is not None
     assert response.qr_code_url is not None
     assert len(response.backup_codes) == 10
     assert all(len(code) == 8 for code in response.backup_codes)
-
-@pytest.mark.asyncio
-async def test_totp_verify_valid_code(mfa_service, test_user, db_session):
-    """Test TOTP verification with valid code"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
-    # Setup TOTP first
-    setup_response = await mfa_service.setup_totp(test_user["id"], test_user["email"])
     
     # Generate a valid TOTP code using the actual secret from setup
-    from app.utils.totp import TOTPManager
-    totp_code = TOTPManager.get_current_code(setup_response.secret)
-    
-    # First enable TOTP by verifying the setup
-    await mfa_service.verify_totp_setup(test_user["id"], totp_code)
+    totp_code = TOTPManager.get_current_code(response.secret)
     
-    # Now verify the code for login
-    result = await mfa_service.verify_totp(test_user["id"], totp_code)
+    result = await mfa_service.verify_totp_setup(test_user["id"], totp_code)
     assert result is True
 
-@pytest.mark.asyncio
-async def test_totp_verify_invalid_code(mfa_service, test_user, db_session):
-    """Test TOTP verification with invalid code"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
-    # Setup TOTP first
-    await mfa_service.setup_totp(test_user["id"], test_user["email"])
-    
-    # Try to verify with invalid code
-    result = await mfa_service.verify_totp(test_user["id"], "123456")
-    assert result is False
+@pytest.mark.parametrize("valid_code", [
+    pytest.param(True, id="valid_code"),
+    pytest.param(False, id="invalid_code"),
+])
+async def test_totp_verify(mfa_service, test_user_with_totp, valid_code):
+    """Test TOTP verification with a valid and an invalid code"""
+    totp_code = TOTPManager.get_current_code(test_user_with_totp["totp_secret"]) if valid_code else "123456"
+    
+    result = await mfa_service.verify_totp(test_user_with_totp["id"], totp_code)
+    assert result is valid_code
 
-@pytest.mark.asyncio
-async def test_totp_disable(mfa_service, test_user, db_session):
+async def test_totp_disable(mfa_service, test_user_with_totp):
     """Test TOTP disable"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
-    # Setup and enable TOTP first
-    setup_response = await mfa_service.setup_totp(test_user["id"], test_user["email"])
-    
-    # Generate a valid TOTP code using the actual secret from setup
-    from app.utils.totp import TOTPManager
-    totp_code = TOTPManager.get_current_code(setup_response.secret)
-    
-    # First enable TOTP by verifying the setup
-    await mfa_service.verify_totp_setup(test_user["id"], totp_code)
+    totp_code = TOTPManager.get_current_code(test_user_with_totp["totp_secret"])
     
-    # Now disable TOTP
-    result = await mfa_service.disable_totp(test_user["id"], totp_code)
+    result = await mfa_service.disable_totp(test_user_with_totp["id"], totp_code)
     assert result is True
 
-@pytest.mark.asyncio
-async def test_backup_codes_verify_valid_code(mfa_service, test_user_with_totp, db_session):
+async def test_backup_codes_verify_valid_code(mfa_service, test_user_with_totp):
     """Test backup codes verification with valid code"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user_with_totp["id"]
-    )
     # Get backup codes from the setup
     backup_codes = test_user_with_totp["backup_codes"]
     
@@ -162,24 +85,35 @@ async def test_backup_codes_verify_valid_code(mfa_service, test_user_with_totp,
     result = await mfa_service.verify_backup_code(test_user_with_totp["id"], backup_codes[0])
     assert result is True
 
-@pytest.mark.asyncio
-async def test_backup_codes_verify_invalid_code(mfa_service, test_user_with_totp, db_session):
-    """Test backup codes verification with invalid code"""
+async def test_backup_codes_verify_legacy_format(mfa_service, test_user, db_session):
+    """Test consuming a backup code stored in the comma-separated Fernet format"""
+    backup_codes = TOTPManager.generate_backup_codes()
+    legacy = mfa_service.totp_encryption.fernet.encrypt(",".join(backup_codes).encode()).decode()
     await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user_with_totp["id"]
+        "UPDATE users SET backup_codes_encrypted = $1, backup_codes_remaining = $2 WHERE id = $3",
+        legacy, len(backup_codes), test_user["id"]
     )
+    
+    result = await mfa_service.verify_backup_code(test_user["id"], backup_codes[0])
+    assert result is True
+    
+    # The remaining codes are written back in the current format
+    row = await db_session.fetchrow(
+        "SELECT backup_codes_encrypted, backup_codes_remaining FROM users WHERE id = $1",
+        test_user["id"]
+    )
+    remaining = mfa_service.totp_encryption.decrypt_backup_codes(row["backup_codes_encrypted"])
+    assert sorted(remaining) == sorted(backup_codes[1:])
+    assert row["backup_codes_remaining"] == len(backup_codes) - 1
+
+async def test_backup_codes_verify_invalid_code(mfa_service, test_user_with_totp):
+    """Test backup codes verification with invalid code"""
     # Try to use invalid backup code
     result = await mfa_service.verify_backup_code(test_user_with_totp["id"], "invalid-code")
     assert result is False
 
-@pytest.mark.asyncio
-async def test_backup_codes_verify_used_code(mfa_service, test_user_with_totp, db_session):
+async def test_backup_codes_verify_used_code(mfa_service, test_user_with_totp):
     """Test backup codes verification with already used code"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user_with_totp["id"]
-    )
     # Get backup codes from the setup
     backup_codes = test_user_with_totp["backup_codes"]
     
@@ -191,43 +125,17 @@ async def test_backup_codes_verify_used_code(mfa_service, test_user_with_totp, d
     result = await mfa_service.verify_backup_code(test_user_with_totp["id"], backup_codes[0])
     assert result is False
 
-@pytest.mark.asyncio
-async def test_email_mfa_setup(mfa_service, test_user, db_session):
-    """Test email MFA setup"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
+async def test_email_mfa_lifecycle(mfa_service, test_user):
+    """Test email MFA setup, verification and disabling in sequence"""
+    # Setup
     result = await mfa_service.setup_email_mfa(test_user["id"])
     assert result is True
-
-@pytest.mark.asyncio
-async def test_email_mfa_verify(mfa_service, test_user, db_session):
-    """Test email MFA verification"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
-    # Setup email MFA first
-    await mfa_service.setup_email_mfa(test_user["id"])
     
-    # Send an email MFA code
+    # Send an email MFA code and verify with it
     code = await mfa_service.send_email_mfa_code(test_user["id"], test_user["email"])
-    
-    # Verify with the sent code
     result = await mfa_service.verify_email_mfa(test_user["id"], code)
     assert result is True
-
-@pytest.mark.asyncio
-async def test_email_mfa_disable(mfa_service, test_user, db_session):
-    """Test email MFA disable"""
-    await db_session.execute(
-        "UPDATE users SET profile_status = 'active', email_verified = TRUE WHERE id = $1",
-        test_user["id"]
-    )
-    # Setup email MFA first
-    await mfa_service.setup_email_mfa(test_user["id"])
     
-    # Disable email MFA
+    # Disable
     result = await mfa_service.disable_email_mfa(test_user["id"])
-    assert result is True 
\ No newline at end of file
+    assert result is True
@@ -0,0 +1,120 @@
+import base64
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import Fernet, InvalidToken
+from app.utils import totp
+from app.utils.totp import TOTPEncryption, TOTPManager
+
+# A fixed key keeps these tests independent of the configured FERNET_KEY
+TEST_KEY = "AAECAwQFBgcICQoLDA0ODxAREhMUFRYXGBkaGxwdHh8="
+
+# "JBSWY3DPEHPK3PXP" encrypted under TEST_KEY as 0x01 || nonce (bytes 0-11) || ciphertext+tag
+KNOWN_AESGCM_SECRET = "AQABAgMEBQYHCAkKC87sWlvy7Jkl1n1eYohVxo7cRPfMLCIZ0uP_6SB_dLNs"
+
+# RFC 4226 appendix D secret ("12345678901234567890") and its HOTP values by counter
+RFC_SECRET = "GEZDGNBVGY3TQOJQGEZDGNBVGY3TQOJQ"
+RFC_CODES = ["755224", "287082", "359152", "969429", "338314", "254676", "287922"]
+
+BACKUP_CODES = ["12345678", "87654321", "00000042", "99999999"]
+
+# A time inside TOTP step 4
+STEP_4_TIME = 4 * 30 + 1
+
+
+@pytest.fixture
+def encryption():
+    """TOTP encryption bound to the test key"""
+    return TOTPEncryption(TEST_KEY)
+
+
+def _tamper(encrypted: str) -> str:
+    """Flip one bit in the last byte of an encrypted value"""
+    raw = bytearray(base64.urlsafe_b64decode(encrypted.encode()))
+    raw[-1] ^= 0x01
+    return base64.urlsafe_b64encode(bytes(raw)).decode()
+
+
+def test_encrypt_decrypt_round_trip(encryption):
+    """Test that AES-GCM encrypted secrets decrypt to the original value"""
+    encrypted = encryption.encrypt("JBSWY3DPEHPK3PXP")
+    
+    assert encrypted != "JBSWY3DPEHPK3PXP"
+    assert encryption.decrypt(encrypted) == "JBSWY3DPEHPK3PXP"
+
+def test_decrypt_known_aesgcm_value(encryption):
+    """Test that a stored AES-GCM value still decrypts, so format changes break this test"""
+    assert encryption.decrypt(KNOWN_AESGCM_SECRET) == "JBSWY3DPEHPK3PXP"
+
+def test_encrypt_layout(encryption):
+    """Test that encrypted values are the version byte, a 12-byte nonce and ciphertext with a 16-byte tag"""
+    raw = base64.urlsafe_b64decode(encryption.encrypt("JBSWY3DPEHPK3PXP").encode())
+    
+    assert raw[:1] == totp.AESGCM_VERSION
+    assert len(raw) == 1 + 12 + len("JBSWY3DPEHPK3PXP") + 16
+
+def test_decrypt_legacy_fernet_value(encryption):
+    """Test that values written with Fernet before the AES-GCM switch still decrypt"""
+    legacy = Fernet(TEST_KEY.encode()).encrypt(b"JBSWY3DPEHPK3PXP").decode()
+    
+    assert encryption.decrypt(legacy) == "JBSWY3DPEHPK3PXP"
+
+def test_decrypt_tampered_aesgcm_value(encryption):
+    """Test that a modified AES-GCM ciphertext is rejected"""
+    encrypted = encryption.encrypt("JBSWY3DPEHPK3PXP")
+    
+    with pytest.raises(InvalidTag):
+        encryption.decrypt(_tamper(encrypted))
+
+def test_decrypt_tampered_fernet_value(encryption):
+    """Test that a modified legacy Fernet token is rejected"""
+    legacy = Fernet(TEST_KEY.encode()).encrypt(b"JBSWY3DPEHPK3PXP").decode()
+    
+    with pytest.raises(InvalidToken):
+        encryption.decrypt(_tamper(legacy))
+
+def test_decrypt_unknown_format(encryption):
+    """Test that data with an unknown version byte is rejected"""
+    with pytest.raises(ValueError):
+        encryption.decrypt(base64.urlsafe_b64encode(b"\x02" + b"\x00" * 40).decode())
+
+
+def test_backup_codes_round_trip(encryption):
+    """Test that backup codes survive the fixed-width encrypt/decrypt round trip"""
+    encrypted = encryption.encrypt_backup_codes(BACKUP_CODES)
+    
+    assert encryption.decrypt_backup_codes(encrypted) == BACKUP_CODES
+
+def test_backup_codes_round_trip_empty(encryption):
+    """Test that an exhausted backup code list round-trips as empty"""
+    encrypted = encryption.encrypt_backup_codes([])
+    
+    assert encryption.decrypt_backup_codes(encrypted) == []
+
+def test_decrypt_legacy_backup_codes(encryption):
+    """Test that comma-separated Fernet backup codes written before fixed-width slots still decrypt"""
+    legacy = Fernet(TEST_KEY.encode()).encrypt(",".join(BACKUP_CODES).encode()).decode()
+    
+    assert encryption.decrypt_backup_codes(legacy) == BACKUP_CODES
+
+@pytest.fixture
+def frozen_step_4(monkeypatch):
+    """Pin the clock used by TOTP verification to step 4"""
+    monkeypatch.setattr(totp, "_now", lambda: STEP_4_TIME)
+
+
+@pytest.mark.parametrize("step", [
+    pytest.param(4, id="current_step"),
+    pytest.param(3, id="previous_step"),
+    pytest.param(5, id="next_step"),
+])
+def test_verify_code_within_window(frozen_step_4, step):
+    """Test that codes for the current step and one step of drift either way are accepted"""
+    assert TOTPManager.verify_code(RFC_SECRET, RFC_CODES[step]) is True
+
+@pytest.mark.parametrize("step", [
+    pytest.param(2, id="two_steps_behind"),
+    pytest.param(6, id="two_steps_ahead"),
+])
+def test_verify_code_outside_window(frozen_step_4, step):
+    """Test that codes more than one step away are rejected"""
+    assert TOTPManager.verify_code(RFC_SECRET, RFC_CODES[step]) is False